@@ -1,3 +1,4 @@
+import datetime
 import os
 import random
 from flask import Blueprint, jsonify, request
@@ -57,6 +58,47 @@ def set_guest():
     return jsonify({"message": f"Failed to set guest: {bot}, {guest_name}"}), 400
 
 
+@main.route("/api/tts_stats", methods=["GET"])
+def tts_stats():
+    bot = get_bot()
+    if bot and bot.tts_guest:
+        return jsonify(
+            {
+                "backend": bot.tts_guest.backend.stats(),
+                "cache": bot.tts_guest.cache.stats(),
+                "queue": bot.tts_guest.message_queue.stats(),
+                "normalizer": bot.tts_guest.normalizer.stats(),
+                "mixer": bot.tts_guest.mixer.stats(),
+                "prefetched": len(bot.tts_guest.prefetched),
+                "guests": len(bot.tts_guest.guest_list),
+                "router": bot.router.stats(),
+            }
+        )
+    return jsonify({"message": "TTS is not running"}), 404
+
+
+@main.route("/api/chat_stats", methods=["GET"])
+def chat_stats():
+    bot = get_bot()
+    if bot and getattr(bot, "algorithmics", None):
+        return jsonify(bot.algorithmics.analytics.stats())
+    return jsonify({"message": "Chat analytics are not running"}), 404
+
+
+@main.route("/api/vts_status", methods=["GET"])
+def vts_status():
+    bot = get_bot()
+    if bot and getattr(bot, "vtube_studio", None):
+        return jsonify(
+            {
+                **bot.vtube_studio.vts.stats(),
+                "renderer": bot.vtube_studio.renderer.stats(),
+                "items": bot.vtube_studio.items.stats(),
+            }
+        )
+    return jsonify({"message": "VTube Studio is not running"}), 404
+
+
 @main.route("/api/random_avatar", methods=["GET"])
 def random_avatar():
     avatars_dir = os.path.join(os.path.dirname(__file__), "static/avatars")
@@ -79,13 +121,62 @@ def get_guest_message():
     if bot and bot.tts_guest:
         # For demonstration, we return a dummy message
         # Replace this with actual logic to fetch the guest's message
-        if len(bot.tts_guest.message_queue) > 0:
-            message = bot.tts_guest.message_queue.popleft()
+        message = bot.tts_guest.message_queue.popleft()
+        bot.tts_guest.save_queue()
+        if message:
             emit(
                 "message_update",
                 {"message": message.content},
                 namespace="/",
                 broadcast=True,
             )
-            return jsonify({"message": message})
+            return jsonify({"message": message.content})
     return jsonify({"message": "No message available"}), 404
+
+
+def parse_time(value):
+    # Accepts epoch seconds or an ISO 8601 timestamp, taken as UTC if naive
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        timestamp = datetime.datetime.fromisoformat(value)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+        return timestamp.timestamp()
+
+
+@main.route("/api/chat_archive", methods=["GET"])
+def chat_archive():
+    bot = get_bot()
+    if not bot or not bot.archive:
+        return jsonify({"message": "Chat archive is disabled"}), 404
+
+    try:
+        start = parse_time(request.args.get("start"))
+        end = parse_time(request.args.get("end"))
+        limit = int(request.args.get("limit", 1000))
+    except ValueError as e:
+        return jsonify({"message": f"Invalid query: {e}"}), 400
+
+    messages, segments = bot.archive.query(
+        start, end, request.args.get("author"), limit
+    )
+    return jsonify(
+        {
+            "messages": [
+                {
+                    "time": datetime.datetime.fromtimestamp(
+                        timestamp, datetime.timezone.utc
+                    ).isoformat(),
+                    "channel": channel,
+                    "author": author,
+                    "content": content,
+                }
+                for timestamp, channel, author, content in messages
+            ],
+            "segments_scanned": segments,
+            "archive": bot.archive.stats(),
+        }
+    )
@@ -1,7 +1,10 @@
 import asyncio
 import os
 from twitchio.ext import commands
+from cogs.algorithmics import AlgorithmicsCog
+from cogs.chat_archive import CHAT_ARCHIVE_DIR, ChatArchive
 from cogs.logging import logger, prepare as prepare_logging_cog
+from cogs.message_router import MessageRouter
 from cogs.tts_guest import TTSGuestCog
 from cogs.vtube_studio import VTubeStudioCog
 
@@ -15,6 +18,12 @@ class Bot(commands.Bot):
         super().__init__(
             token=ACCESS_TOKEN, prefix="!", initial_channels=TWITCH_CHANNELS
         )
+        # Cogs subscribe here instead of listening to every event_message
+        self.router = MessageRouter()
+        self.archive = None
+        if CHAT_ARCHIVE_DIR:
+            self.archive = ChatArchive()
+            self.router.subscribe(self.archive.append)
 
     async def event_ready(self):
         logger.info(f"Logged in as {self.nick}")
@@ -24,6 +33,7 @@ class Bot(commands.Bot):
         if message.echo:
             return
 
+        self.router.dispatch(message)
         await self.handle_commands(message)
 
     @commands.command()
@@ -49,5 +59,7 @@ def run_bot(socketio):
     bot.add_cog(bot.tts_guest)
     bot.vtube_studio = VTubeStudioCog(bot)
     bot.add_cog(bot.vtube_studio)
+    bot.algorithmics = AlgorithmicsCog(bot)
+    bot.add_cog(bot.algorithmics)
 
     loop.run_until_complete(bot.start())
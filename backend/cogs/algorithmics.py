@@ -1,6 +1,185 @@
+import array
+import hashlib
+import math
+import os
+import threading
+import time
 from twitchio.ext import commands
+from cogs.tts_text import twitch_emote_names
+
+ANALYTICS_WINDOWS = [
+    int(window) for window in os.getenv("ANALYTICS_WINDOWS", "60,300").split(",")
+]
+ANALYTICS_TOP = int(os.getenv("ANALYTICS_TOP", 10))
+# Words beyond this are ignored so a message costs a bounded amount of work
+ANALYTICS_MAX_WORDS = int(os.getenv("ANALYTICS_MAX_WORDS", 20))
+ANALYTICS_MIN_WORD_LENGTH = 3
+
+
+def hash64(value):
+    return int.from_bytes(
+        hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+# Message count over the last `window` seconds in one bucket per second, with
+# a running total so reading the rate never sums the buckets
+class SlidingWindowCounter:
+    def __init__(self, window):
+        self.window = window
+        self.buckets = [0] * window
+        self.total = 0
+        self.second = None
+
+    def advance(self, now):
+        second = int(now)
+        if self.second is None:
+            self.second = second
+        elapsed = min(second - self.second, self.window)
+        for offset in range(1, elapsed + 1):
+            bucket = (self.second + offset) % self.window
+            self.total -= self.buckets[bucket]
+            self.buckets[bucket] = 0
+        self.second = max(second, self.second)
+
+    def add(self, now, count=1):
+        self.advance(now)
+        self.buckets[self.second % self.window] += count
+        self.total += count
+
+    def count(self, now):
+        self.advance(now)
+        return self.total
+
+    def rate(self, now):
+        return self.count(now) / self.window
+
+
+# Cardinality estimate in 2**precision one-byte registers, about 1.6% standard
+# error at the default precision
+class HyperLogLog:
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+        self.alpha = 0.7213 / (1 + 1.079 / self.size)
+
+    def add(self, value):
+        hashed = hash64(value)
+        register = hashed & (self.size - 1)
+        rest = hashed >> self.precision
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def count(self):
+        estimate = (
+            self.alpha
+            * self.size**2
+            / sum(2.0**-register for register in self.registers)
+        )
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = self.size * math.log(self.size / zeros)
+        return round(estimate)
+
+
+# Count-Min sketch for approximate frequencies, with a small candidate table
+# of the heaviest items seen so far
+class HeavyHitters:
+    def __init__(self, top=ANALYTICS_TOP, width=2048, depth=4):
+        self.top = top
+        self.width = width
+        self.depth = depth
+        self.rows = [array.array("L", [0]) * width for _ in range(depth)]
+        self.candidates = {}
+        self.total = 0
+
+    def add(self, item):
+        # Row positions come from one 64-bit hash split into two halves
+        hashed = hash64(item)
+        first, second = hashed & 0xFFFFFFFF, hashed >> 32
+        estimate = None
+        for row, counts in enumerate(self.rows):
+            position = (first + row * second) % self.width
+            counts[position] += 1
+            if estimate is None or counts[position] < estimate:
+                estimate = counts[position]
+        self.total += 1
+
+        if item in self.candidates or len(self.candidates) < self.top * 2:
+            self.candidates[item] = estimate
+            return
+
+        # The table is a small constant size, so this scan stays O(1)
+        weakest = min(self.candidates, key=self.candidates.get)
+        if estimate > self.candidates[weakest]:
+            del self.candidates[weakest]
+            self.candidates[item] = estimate
+
+    def most_common(self, count=None):
+        ranked = sorted(self.candidates.items(), key=lambda item: -item[1])
+        return ranked[: count or self.top]
+
+
+# Updated on the event loop and read from the Flask thread; the sketches
+# mutate even on reads, so both sides hold the lock
+class ChatAnalytics:
+    def __init__(self, windows=ANALYTICS_WINDOWS):
+        self.lock = threading.Lock()
+        self.windows = {window: SlidingWindowCounter(window) for window in windows}
+        self.chatters = HyperLogLog()
+        self.emotes = HeavyHitters()
+        self.words = HeavyHitters()
+        self.messages = 0
+        self.started_at = time.time()
+
+    def add(self, message, now=None):
+        now = now or time.time()
+        emotes = twitch_emote_names(message)
+        words = message.content.split()[:ANALYTICS_MAX_WORDS]
+        with self.lock:
+            self.messages += 1
+            for counter in self.windows.values():
+                counter.add(now)
+            if message.author:
+                self.chatters.add(message.author.name)
+
+            for word in words:
+                if word in emotes:
+                    self.emotes.add(word)
+                elif len(word) >= ANALYTICS_MIN_WORD_LENGTH and word[0] != "!":
+                    self.words.add(word.lower())
+
+    def stats(self, now=None):
+        now = now or time.time()
+        with self.lock:
+            return {
+                "messages": self.messages,
+                "uptime": now - self.started_at,
+                "rates": {
+                    f"{window}s": counter.rate(now)
+                    for window, counter in self.windows.items()
+                },
+                "unique_chatters": self.chatters.count(),
+                "top_emotes": self.emotes.most_common(),
+                "top_words": self.words.most_common(),
+            }
 
 
 class AlgorithmicsCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.analytics = ChatAnalytics()
+        bot.router.subscribe(self.analytics.add)
+
+    @commands.command(name="chatstats")
+    async def chat_stats(self, ctx):
+        stats = self.analytics.stats()
+        rate = stats["rates"][f"{min(self.analytics.windows)}s"]
+        emotes = ", ".join(emote for emote, _ in stats["top_emotes"][:3])
+        await ctx.send(
+            f"{rate * 60:.0f} messages/min, ~{stats['unique_chatters']} chatters"
+            + (f", top emotes: {emotes}" if emotes else "")
+        )
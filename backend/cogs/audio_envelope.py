@@ -0,0 +1,63 @@
+import os
+import numpy as np
+
+TTS_ENVELOPE_FPS = int(os.getenv("TTS_ENVELOPE_FPS", 30))
+TTS_ENVELOPE_MODE = os.getenv("TTS_ENVELOPE_MODE", "rms")
+TTS_ENVELOPE_BINARY = os.getenv("TTS_ENVELOPE_BINARY", "true").lower() != "false"
+
+# Keeps near-silent utterances from being stretched to a full bounce
+ENVELOPE_FLOOR = 0.05
+
+
+class EnvelopeFollower:
+    def __init__(
+        self, sample_rate, frame_rate=TTS_ENVELOPE_FPS, mode=TTS_ENVELOPE_MODE
+    ):
+        self.sample_rate = sample_rate
+        self.frame_rate = frame_rate
+        self.frame_length = max(1, sample_rate // frame_rate)
+        self.mode = mode
+        self.peak = ENVELOPE_FLOOR
+        self.pending = np.empty(0, dtype=np.float32)
+
+    def feed(self, samples):
+        # Returns one uint8 level per complete frame; leftover samples are
+        # carried over to the next chunk
+        samples = samples.astype(np.float32) / 32768.0
+        if self.pending.size:
+            samples = np.concatenate((self.pending, samples))
+
+        usable = samples.size - samples.size % self.frame_length
+        self.pending = samples[usable:]
+        if not usable:
+            return b""
+
+        return self.quantize(samples[:usable].reshape(-1, self.frame_length))
+
+    def flush(self):
+        if not self.pending.size:
+            return b""
+
+        frame = self.pending.reshape(1, -1)
+        self.pending = np.empty(0, dtype=np.float32)
+        return self.quantize(frame)
+
+    def quantize(self, frames):
+        if self.mode == "peak":
+            levels = np.max(np.abs(frames), axis=1)
+        else:
+            levels = np.sqrt(np.mean(np.square(frames), axis=1))
+
+        # The final peak is unknown while streaming, so scale against the
+        # loudest frame seen so far
+        self.peak = max(self.peak, float(np.max(levels)))
+        return np.rint(levels * (255 / self.peak)).astype(np.uint8).tobytes()
+
+
+def encode_envelope(envelope):
+    # Bytes go out as a binary Socket.IO attachment; a list of ints is kept
+    # for clients that cannot handle attachments
+    if TTS_ENVELOPE_BINARY:
+        return envelope
+
+    return list(envelope)
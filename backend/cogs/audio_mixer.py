@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+import numpy as np
+import pyaudio
+from cogs.logging import logger
+
+AUDIO_MIXER_BLOCK = int(os.getenv("AUDIO_MIXER_BLOCK", 512))
+AUDIO_SOURCE_BUFFER_SECONDS = float(os.getenv("AUDIO_SOURCE_BUFFER_SECONDS", 2))
+AUDIO_DUCKING_GAIN = float(os.getenv("AUDIO_DUCKING_GAIN", 0.35))
+# Seconds a writer waits on a full ring without the output reading from it
+AUDIO_STALL_TIMEOUT = float(os.getenv("AUDIO_STALL_TIMEOUT", 1))
+
+
+# One voice in the mix, fed by a producer thread through a fixed-size ring
+# buffer. Writes block while the ring is full, which paces the producer to the
+# output device the same way a blocking stream write would.
+class MixerSource:
+    def __init__(
+        self,
+        name,
+        capacity,
+        gain=1.0,
+        duck_others=False,
+        stall_timeout=AUDIO_STALL_TIMEOUT,
+    ):
+        self.name = name
+        self.stall_timeout = stall_timeout
+        self.gain = gain
+        self.duck_others = duck_others
+        self.ring = np.zeros(capacity, dtype=np.int16)
+        self.read_pos = 0
+        self.write_pos = 0
+        self.closed = False
+        self.cancelled = False
+        self.underruns = 0
+        self.condition = threading.Condition()
+        self.finished = threading.Event()
+        self.finished_at = None
+
+    @property
+    def active(self):
+        return self.write_pos > self.read_pos
+
+    def write(self, samples):
+        # Returns False if the source was cancelled, which it also does itself
+        # when the output stops reading while the ring is full
+        capacity = self.ring.size
+        offset = 0
+        while offset < samples.size:
+            with self.condition:
+                while self.write_pos - self.read_pos >= capacity:
+                    if self.cancelled:
+                        return False
+                    read_pos = self.read_pos
+                    if (
+                        not self.condition.wait(self.stall_timeout)
+                        and self.read_pos == read_pos
+                    ):
+                        self.cancel()
+                        return False
+                if self.cancelled:
+                    return False
+
+                count = min(
+                    capacity - (self.write_pos - self.read_pos), samples.size - offset
+                )
+                start = self.write_pos % capacity
+                first = min(count, capacity - start)
+                self.ring[start : start + first] = samples[offset : offset + first]
+                self.ring[: count - first] = samples[offset + first : offset + count]
+                self.write_pos += count
+                offset += count
+        return True
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+
+    def cancel(self):
+        with self.condition:
+            self.cancelled = True
+            self.closed = True
+            self.read_pos = self.write_pos
+            self.condition.notify_all()
+
+    def read(self, count):
+        # Called from the audio callback; never blocks on the producer
+        with self.condition:
+            available = min(self.write_pos - self.read_pos, count)
+            start = self.read_pos % self.ring.size
+            first = min(available, self.ring.size - start)
+            samples = np.concatenate(
+                (self.ring[start : start + first], self.ring[: available - first])
+            )
+            if available < count and self.read_pos and not self.closed:
+                self.underruns += 1
+            self.read_pos += available
+            self.condition.notify_all()
+            drained = self.closed and self.read_pos == self.write_pos
+
+        return samples, drained
+
+
+class AudioMixer:
+    def __init__(self, sample_rate, block=AUDIO_MIXER_BLOCK):
+        self.sample_rate = sample_rate
+        self.block = block
+        self.sources = []
+        self.lock = threading.Lock()
+        self.underruns = 0
+        self.source_underruns = 0
+        self.pyaudio = pyaudio.PyAudio()
+        # Opened once and left running; idle periods are filled with silence.
+        # It is started only once the latencies the callback reads are set.
+        self.stream = self.pyaudio.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=sample_rate,
+            output=True,
+            frames_per_buffer=block,
+            stream_callback=self.callback,
+            start=False,
+        )
+        self.output_latency = self.stream.get_output_latency()
+        self.latency = self.output_latency + block / sample_rate
+        self.stream.start_stream()
+        logger.info(f"Audio output open, latency {self.latency * 1000:.0f}ms")
+
+    def add_source(self, name, gain=1.0, duck_others=False):
+        source = MixerSource(
+            name,
+            int(AUDIO_SOURCE_BUFFER_SECONDS * self.sample_rate),
+            gain,
+            duck_others,
+        )
+        with self.lock:
+            self.sources.append(source)
+        return source
+
+    def callback(self, in_data, frame_count, time_info, status):
+        if status & pyaudio.paOutputUnderflow:
+            self.underruns += 1
+
+        # Time until the first sample of this block reaches the speakers
+        delay = time_info["output_buffer_dac_time"] - time_info["current_time"]
+        if delay <= 0:
+            # Some hosts, ALSA among them, report no DAC time
+            delay = self.output_latency
+
+        with self.lock:
+            sources = list(self.sources)
+        ducked = any(source.duck_others and source.active for source in sources)
+
+        mix = np.zeros(frame_count, dtype=np.float32)
+        for source in sources:
+            samples, drained = source.read(frame_count)
+            gain = source.gain
+            if ducked and not source.duck_others:
+                gain *= AUDIO_DUCKING_GAIN
+            mix[: samples.size] += samples * gain
+
+            if drained:
+                source.finished_at = (
+                    time.monotonic() + delay + samples.size / self.sample_rate
+                )
+                source.finished.set()
+                with self.lock:
+                    self.sources.remove(source)
+                    self.source_underruns += source.underruns
+
+        np.clip(mix, -32768, 32767, out=mix)
+        return mix.astype("<i2").tobytes(), pyaudio.paContinue
+
+    def wait(self, source, timeout=None):
+        # Returns once the source's last sample has actually been heard
+        if not source.finished.wait(timeout):
+            return False
+
+        remaining = source.finished_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return True
+
+    def stats(self):
+        with self.lock:
+            sources = list(self.sources)
+            source_underruns = self.source_underruns
+        return {
+            "sample_rate": self.sample_rate,
+            "latency": self.latency,
+            "device_underruns": self.underruns,
+            "source_underruns": source_underruns
+            + sum(source.underruns for source in sources),
+            "sources": [
+                {"name": source.name, "underruns": source.underruns}
+                for source in sources
+            ],
+        }
+
+    def close(self):
+        with self.lock:
+            sources, self.sources = self.sources, []
+        # Unblocks producers still writing
+        for source in sources:
+            source.cancel()
+        self.stream.stop_stream()
+        self.stream.close()
+        self.pyaudio.terminate()
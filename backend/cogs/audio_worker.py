@@ -0,0 +1,59 @@
+import asyncio
+import concurrent.futures
+import os
+import queue
+import threading
+from cogs.logging import logger
+
+AUDIO_WORKER_QUEUE_SIZE = int(os.getenv("AUDIO_WORKER_QUEUE_SIZE", 8))
+
+
+# Runs blocking synthesis and playback jobs on a dedicated thread. Coroutines
+# hand work over with `run`, which only awaits a future, so the twitchio event
+# loop keeps handling chat while audio is playing.
+class AudioWorker:
+    def __init__(self, name="audio-worker", maxsize=AUDIO_WORKER_QUEUE_SIZE):
+        self.jobs = queue.Queue(maxsize=maxsize)
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+        logger.debug(f"{self.thread.name} stopped")
+
+    async def run(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        job = (future, fn, args, kwargs)
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            # Wait for room off the event loop so a full queue never stalls chat
+            logger.debug(f"{self.thread.name} queue full, waiting for a free slot")
+            await asyncio.get_running_loop().run_in_executor(None, self.jobs.put, job)
+
+        return await asyncio.wrap_future(future)
+
+    def stop(self, timeout=None):
+        # Jobs still waiting are cancelled, only the running one finishes
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job:
+                job[0].cancel()
+        self.jobs.put(None)
+        self.thread.join(timeout)
@@ -0,0 +1,53 @@
+import atexit
+import threading
+from cogs.logging import logger
+
+
+# Buffers records appended on the event loop and hands them to `write` in
+# batches on a background thread, every flush_interval seconds and once more
+# on close. `on_close` runs on that thread after the final batch.
+class BatchWriter:
+    def __init__(self, name, write, flush_interval, on_close=None):
+        self.name = name
+        self.write = write
+        self.flush_interval = flush_interval
+        self.on_close = on_close
+        self.pending = []
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def append(self, record):
+        # Cheap enough to call from the event loop on every message
+        with self.condition:
+            self.pending.append(record)
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.stopped, self.flush_interval)
+                records, self.pending = self.pending, []
+                stopped = self.stopped
+
+            try:
+                if records:
+                    self.write(records)
+                if stopped and self.on_close:
+                    self.on_close()
+            except OSError as e:
+                logger.error(f"{self.name} failed to write: {e}")
+
+            if stopped:
+                return
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread and self.thread.is_alive():
+            self.thread.join()
@@ -0,0 +1,238 @@
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+from cogs.batch_writer import BatchWriter
+from cogs.logging import logger
+from cogs.twitch_time import twitch_time
+
+CHAT_ARCHIVE_DIR = os.path.expanduser(
+    os.getenv("CHAT_ARCHIVE_DIR", "~/.local/share/beth-the-bot/chat")
+)
+CHAT_ARCHIVE_FLUSH_INTERVAL = float(os.getenv("CHAT_ARCHIVE_FLUSH_INTERVAL", 2))
+CHAT_ARCHIVE_SEGMENT_SECONDS = float(os.getenv("CHAT_ARCHIVE_SEGMENT_SECONDS", 3600))
+CHAT_ARCHIVE_SEGMENT_MESSAGES = int(os.getenv("CHAT_ARCHIVE_SEGMENT_MESSAGES", 100000))
+
+
+def message_time(message):
+    if message.timestamp is None:
+        return time.time()
+    return twitch_time(message.timestamp).timestamp()
+
+
+# Time range and per-author message counts for one segment, enough to decide
+# whether a query needs to open it at all
+class SegmentIndex:
+    def __init__(self, path, start=None, end=None, count=0, authors=None):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.count = count
+        self.authors = authors or {}
+
+    @property
+    def index_path(self):
+        return self.path.replace(".jsonl.gz", ".idx.json")
+
+    def add(self, record):
+        timestamp, _, author, _ = record
+        self.start = timestamp if self.start is None else min(self.start, timestamp)
+        self.end = timestamp if self.end is None else max(self.end, timestamp)
+        self.count += 1
+        self.authors[author] = self.authors.get(author, 0) + 1
+
+    def matches(self, start, end, author):
+        if not self.count:
+            return False
+        if start is not None and self.end < start:
+            return False
+        if end is not None and self.start > end:
+            return False
+        return author is None or author in self.authors
+
+    def save(self):
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "start": self.start,
+                    "end": self.end,
+                    "count": self.count,
+                    "authors": self.authors,
+                },
+                f,
+            )
+        os.replace(temp_path, self.index_path)
+
+    @classmethod
+    def load(cls, path, save=True):
+        index = cls(path)
+        try:
+            with open(index.index_path, encoding="utf-8") as f:
+                data = json.load(f)
+            return cls(path, data["start"], data["end"], data["count"], data["authors"])
+        except (OSError, ValueError, KeyError):
+            # Left unsealed by a crash; rebuilt from the segment once
+            for record in read_segment(path):
+                index.add(record)
+            if save:
+                index.save()
+            return index
+
+
+def read_segment(path):
+    # Each batch is its own gzip member, so a torn final batch only loses
+    # the records written with it
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+    except (EOFError, OSError, ValueError) as e:
+        logger.warning(f"Chat archive segment {path} is truncated: {e}")
+
+
+# Append-only chat history in compressed segments that rotate by age or size.
+# Messages are buffered on the event loop and written by a background thread,
+# one gzip member per batch. A read-only archive never writes, so it can be
+# opened on the directory of a running bot.
+class ChatArchive:
+    def __init__(
+        self,
+        directory=CHAT_ARCHIVE_DIR,
+        flush_interval=CHAT_ARCHIVE_FLUSH_INTERVAL,
+        segment_seconds=CHAT_ARCHIVE_SEGMENT_SECONDS,
+        segment_messages=CHAT_ARCHIVE_SEGMENT_MESSAGES,
+        read_only=False,
+    ):
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.segment_messages = segment_messages
+        # Held while the writer appends, so queries never read a half batch
+        self.lock = threading.Lock()
+        # The newest segment may still be growing in another process, so a
+        # read-only archive does not save an index rebuilt from it
+        self.segments = [
+            SegmentIndex.load(path, save=not read_only)
+            for path in sorted(glob.glob(os.path.join(directory, "chat-*.jsonl.gz")))
+        ]
+        self.current = None
+        self.written = 0
+        self.writer = None
+        if not read_only:
+            self.writer = BatchWriter(
+                "chat-archive", self.write, flush_interval, self.seal
+            )
+            self.writer.start()
+
+    def append(self, message):
+        record = (
+            message_time(message),
+            message.channel.name if message.channel else None,
+            message.author.name if message.author else None,
+            message.content,
+        )
+        self.writer.append(record)
+
+    def seal(self):
+        if self.current:
+            self.current.save()
+
+    def write(self, records):
+        if self.current and (
+            self.current.count >= self.segment_messages
+            or records[0][0] - self.current.start >= self.segment_seconds
+        ):
+            # Seal the segment; its index is final from here on
+            self.current.save()
+            self.current = None
+
+        if not self.current:
+            path = os.path.join(
+                self.directory, f"chat-{int(records[0][0] * 1000):015d}.jsonl.gz"
+            )
+            self.current = SegmentIndex(path)
+            with self.lock:
+                self.segments.append(self.current)
+
+        data = "".join(
+            json.dumps(record, ensure_ascii=False) + "\n" for record in records
+        )
+        with self.lock:
+            with gzip.open(self.current.path, "at", encoding="utf-8") as f:
+                f.write(data)
+            for record in records:
+                self.current.add(record)
+        self.written += len(records)
+
+    def query(self, start=None, end=None, author=None, limit=1000):
+        # Times are epoch seconds; only segments whose index overlaps the
+        # range and mentions the author are decompressed
+        if author:
+            author = author.lower()
+        with self.lock:
+            segments = [
+                segment
+                for segment in self.segments
+                if segment.matches(start, end, author)
+            ]
+
+        messages = []
+        for segment in segments:
+            with self.lock:
+                records = list(read_segment(segment.path))
+            for record in records:
+                timestamp, _, record_author, _ = record
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp > end:
+                    continue
+                if author is not None and record_author != author:
+                    continue
+                messages.append(record)
+                if len(messages) >= limit:
+                    return messages, len(segments)
+        return messages, len(segments)
+
+    def replay(self, start=None, end=None, author=None):
+        # Yields archived records in time order for feeding back into the bot
+        if author:
+            author = author.lower()
+        with self.lock:
+            segments = [
+                segment
+                for segment in self.segments
+                if segment.matches(start, end, author)
+            ]
+
+        for segment in segments:
+            with self.lock:
+                records = list(read_segment(segment.path))
+            records.sort(key=lambda record: record[0])
+            for record in records:
+                if start is not None and record[0] < start:
+                    continue
+                if end is not None and record[0] > end:
+                    return
+                if author is None or record[2] == author:
+                    yield record
+
+    def stats(self):
+        with self.lock:
+            return {
+                "segments": len(self.segments),
+                "messages": sum(segment.count for segment in self.segments),
+                "bytes": sum(
+                    os.path.getsize(segment.path)
+                    for segment in self.segments
+                    if os.path.exists(segment.path)
+                ),
+                "written": self.written,
+            }
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
@@ -0,0 +1,93 @@
+import datetime
+import os
+import random
+from cogs.twitch_time import twitch_time
+
+GUEST_PICK_HALF_LIFE = float(os.getenv("GUEST_PICK_HALF_LIFE", 0))
+# Lower bound on an entrant's pick weight, which also bounds the expected
+# number of rejection sampling rounds
+GUEST_PICK_MIN_WEIGHT = 0.05
+
+
+# Guests are kept by name only, rather than as whole twitchio Chatter objects
+class SimpleChatter:
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+
+# Guest entrants as (chatter, timestamp) tuples in a dense list, with a dict
+# from name to list position. Joins, timestamp refreshes, lookups, removals
+# and random picks are all O(1); removal swaps the last entry into the hole.
+class GuestRegistry:
+    def __init__(self, half_life=GUEST_PICK_HALF_LIFE):
+        self.entries = []
+        self.index = {}
+        self.half_life = half_life
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __bool__(self):
+        return bool(self.entries)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def add(self, chatter, timestamp):
+        # Returns False when the chatter was already entered and only their
+        # timestamp was refreshed
+        position = self.index.get(chatter.name)
+        if position is not None:
+            self.entries[position] = (self.entries[position][0], timestamp)
+            return False
+
+        self.index[chatter.name] = len(self.entries)
+        self.entries.append((chatter, timestamp))
+        return True
+
+    def get(self, name):
+        position = self.index.get(name)
+        return self.entries[position] if position is not None else None
+
+    def remove(self, name):
+        position = self.index.pop(name, None)
+        if position is None:
+            return None
+
+        entry = self.entries[position]
+        last = self.entries.pop()
+        if position < len(self.entries):
+            self.entries[position] = last
+            self.index[last[0].name] = position
+        return entry
+
+    def pick(self):
+        # Removes and returns a random entrant; with a half-life configured,
+        # recent !guest requests are favoured through rejection sampling
+        if not self.entries:
+            return None
+
+        entry = random.choice(self.entries)
+        if self.half_life > 0:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            while random.random() > self.weight(entry, now):
+                entry = random.choice(self.entries)
+
+        return self.remove(entry[0].name)
+
+    def weight(self, entry, now):
+        timestamp = entry[1]
+        if timestamp is None:
+            return GUEST_PICK_MIN_WEIGHT
+
+        age = (now - twitch_time(timestamp)).total_seconds()
+        return max(GUEST_PICK_MIN_WEIGHT, 0.5 ** (max(age, 0) / self.half_life))
+
+    def clear(self):
+        self.entries.clear()
+        self.index.clear()
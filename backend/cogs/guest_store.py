@@ -0,0 +1,152 @@
+import datetime
+import json
+import os
+from cogs.batch_writer import BatchWriter
+from cogs.logging import logger
+from cogs.guest_registry import SimpleChatter
+from cogs.tts_queue import QueuedMessage
+
+GUEST_STATE_DIR = os.path.expanduser(
+    os.getenv("GUEST_STATE_DIR", "~/.local/state/beth-the-bot")
+)
+GUEST_STATE_FLUSH_INTERVAL = float(os.getenv("GUEST_STATE_FLUSH_INTERVAL", 1))
+GUEST_STATE_COMPACT_RECORDS = int(os.getenv("GUEST_STATE_COMPACT_RECORDS", 5000))
+
+
+def encode_time(timestamp):
+    return timestamp.isoformat() if timestamp else None
+
+
+def decode_time(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+# Persists the guest list, current guest and pending messages as a compact
+# JSON snapshot plus an append-only log of changes since that snapshot.
+# Changes are only buffered on the event loop; a writer thread appends them to
+# the log in batches and folds them into a new snapshot once the log grows.
+class GuestStore:
+    def __init__(
+        self,
+        directory=GUEST_STATE_DIR,
+        flush_interval=GUEST_STATE_FLUSH_INTERVAL,
+        compact_records=GUEST_STATE_COMPACT_RECORDS,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, "guests.json")
+        self.log_path = os.path.join(directory, "guests.log")
+        self.compact_records = compact_records
+        self.writer = BatchWriter("guest-store", self.write, flush_interval)
+        self.state = {"guests": {}, "current": None, "queue": []}
+        self.log_records = 0
+
+    def load(self):
+        # Returns the state left by the previous run: the snapshot with the
+        # log replayed over it. A torn final log line is discarded.
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read guest snapshot: {e}")
+
+        try:
+            with open(self.log_path, "r+b") as f:
+                good = 0
+                for line in f:
+                    # Only whole lines count; the last one may have been cut
+                    # short by a crash mid-write
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("unterminated line")
+                        self.apply(json.loads(line))
+                    except ValueError:
+                        # New records would otherwise be appended onto the
+                        # torn tail and lost along with it on the next load
+                        logger.warning(f"Discarding torn guest log tail at byte {good}")
+                        f.truncate(good)
+                        break
+                    good += len(line)
+                    self.log_records += 1
+        except FileNotFoundError:
+            pass
+
+        guests = [
+            (SimpleChatter(name), decode_time(timestamp))
+            for name, timestamp in self.state["guests"].items()
+        ]
+        current = self.state["current"]
+        if current:
+            current = (SimpleChatter(current[0]), decode_time(current[1]))
+        queue = [
+            QueuedMessage(SimpleChatter(name), content, decode_time(timestamp))
+            for name, content, timestamp in self.state["queue"]
+        ]
+        logger.info(
+            f"Restored {len(guests)} guests and {len(queue)} messages "
+            f"({self.log_records} log records)"
+        )
+        return guests, current, queue
+
+    def start(self):
+        self.writer.start()
+
+    def apply(self, record):
+        op = record[0]
+        if op == "join":
+            self.state["guests"][record[1]] = record[2]
+        elif op == "leave":
+            self.state["guests"].pop(record[1], None)
+        elif op == "current":
+            self.state["current"] = record[1]
+        elif op == "queue":
+            self.state["queue"] = record[1]
+
+    def record(self, *record):
+        self.writer.append(record)
+
+    def join(self, name, timestamp):
+        self.record("join", name, encode_time(timestamp))
+
+    def leave(self, name):
+        self.record("leave", name)
+
+    def set_current(self, guest):
+        if guest:
+            self.record("current", [guest[0].name, encode_time(guest[1])])
+        else:
+            self.record("current", None)
+
+    def set_queue(self, messages):
+        self.record(
+            "queue",
+            [
+                [message.author.name, message.content, encode_time(message.timestamp)]
+                for message in messages
+            ],
+        )
+
+    def write(self, records):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+
+        for record in records:
+            self.apply(record)
+        self.log_records += len(records)
+
+        if self.log_records >= self.compact_records:
+            self.compact()
+
+    def compact(self):
+        temp_path = f"{self.snapshot_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.snapshot_path)
+        # The snapshot now covers everything in the log
+        open(self.log_path, "w").close()
+        logger.debug(f"Compacted {self.log_records} guest log records")
+        self.log_records = 0
+
+    def close(self):
+        self.writer.close()
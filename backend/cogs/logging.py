@@ -1,4 +1,11 @@
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
+import queue
+import random
+import threading
 import colorlog
 import os
 from twitchio.ext import commands
@@ -11,10 +18,110 @@ LOG_LEVELS = {
     "CRIT": logging.CRITICAL,
 }
 LOG_LEVEL = LOG_LEVELS.get(os.getenv("LOG_LEVEL"), logging.INFO)
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() != "false"
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 256))
+LOG_JSON_PATH = os.path.expanduser(os.getenv("LOG_JSON_PATH", ""))
+LOG_CHAT_SAMPLE = float(os.getenv("LOG_CHAT_SAMPLE", 1))
+
+
+# Writes a whole batch of records with a single write and flush
+class BatchMixin:
+    def emit_batch(self, records):
+        lines = []
+        for record in records:
+            if record.levelno < self.level or not self.filter(record):
+                continue
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+
+        if lines:
+            with self.lock:
+                self.stream.write("".join(lines))
+                self.flush()
+
+
+class BatchStreamHandler(BatchMixin, colorlog.StreamHandler):
+    pass
+
+
+class BatchFileHandler(BatchMixin, logging.FileHandler):
+    pass
+
+
+class JsonFormatter(logging.Formatter):
+    FIELDS = ("author", "channel")
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# Hands records over untouched; the stock QueueHandler formats the message on
+# the calling thread, which is the work being moved off the event loop
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+# Drains the log queue on a background thread, formatting and writing records
+# in batches so a burst of chat costs one write per handler
+class BatchLogWriter:
+    def __init__(self, handlers, batch_size=LOG_BATCH_SIZE):
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                stopping = True
+                batch = [record for record in batch if record is not None]
+
+            for handler in self.handlers:
+                handler.emit_batch(batch)
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return self.rate >= 1 or random.random() < self.rate
 
 
 def setup_logger(name):
-    handler = colorlog.StreamHandler()
+    handler = BatchStreamHandler()
     handler.setFormatter(
         colorlog.ColoredFormatter(
             "%(asctime)s - %(log_color)s%(levelname)s%(reset)s - %(message)s",
@@ -27,24 +134,43 @@ def setup_logger(name):
             },
         )
     )
+    handlers = [handler]
+
+    if LOG_JSON_PATH:
+        json_handler = BatchFileHandler(LOG_JSON_PATH, encoding="utf-8")
+        json_handler.setFormatter(JsonFormatter())
+        handlers.append(json_handler)
 
     logger = logging.getLogger(name)
-    logger.addHandler(handler)
+    if LOG_ASYNC:
+        writer = BatchLogWriter(handlers)
+        logger.addHandler(DeferredQueueHandler(writer.queue))
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
     logger.setLevel(LOG_LEVEL)
     return logger
 
 
 logger = setup_logger("beth-the-bot")
+# Chat lines go through their own logger so they can be sampled separately
+chat_logger = logger.getChild("chat")
+chat_logger.addFilter(SampleFilter(LOG_CHAT_SAMPLE))
 
 
 class TwitchLoggerCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        bot.router.subscribe(self.log_message)
 
-    @commands.Cog.event()
-    async def event_message(self, message):
-        if not message.echo:
-            logger.info(f"{message.author.name}: {message.content}")
+    def log_message(self, message):
+        # Formatted on the log writer thread, and only if the line is kept
+        chat_logger.info(
+            "%s: %s",
+            message.author.name,
+            message.content,
+            extra={"author": message.author.name, "channel": message.channel.name},
+        )
 
 
 def prepare(bot):
@@ -0,0 +1,191 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
+
+IMAGE_WIDTH = 800
+IMAGE_HEIGHT = 600
+FONT_SIZE = 50
+STROKE_WIDTH = 2
+MARGIN = 10
+TEXT_COLOR = (255, 255, 255, 255)
+BORDER_COLOR = (0, 0, 0, 255)
+MEME_CACHE_ENTRIES = int(os.getenv("MEME_CACHE_ENTRIES", 64))
+# zlib level for the PNGs VTube Studio loads; 1 is several times faster than
+# Pillow's default for a negligible size difference on flat meme text
+MEME_PNG_COMPRESSION = int(os.getenv("MEME_PNG_COMPRESSION", 1))
+MEME_RENDER_WORKERS = int(os.getenv("MEME_RENDER_WORKERS", 2))
+MEME_RENDER_MAX_PENDING = int(os.getenv("MEME_RENDER_MAX_PENDING", 8))
+
+_fonts = {}
+_fonts_lock = threading.Lock()
+
+
+def load_font(path, size):
+    # Parsing a TrueType file is the slowest part of a small render
+    key = (path, size)
+    with _fonts_lock:
+        font = _fonts.get(key)
+        if font is None:
+            font = _fonts[key] = ImageFont.truetype(path, size)
+        return font
+
+
+def warm_worker(font_path, font_size):
+    # Runs once in each pool process so the first meme it renders does not
+    # pay for parsing the font
+    load_font(font_path, font_size)
+    render_meme(font_path, "warm", "up", font_size)
+
+
+def layout(font, top_text, bottom_text, width=IMAGE_WIDTH, height=IMAGE_HEIGHT):
+    # Positions on the full canvas as the meme has always been laid out: top
+    # text centred under the top edge, bottom text centred above the bottom
+    placed = []
+    if top_text:
+        bbox = font.getbbox(top_text, stroke_width=STROKE_WIDTH)
+        placed.append((top_text, ((width - (bbox[2] - bbox[0])) / 2, MARGIN), bbox))
+    if bottom_text:
+        bbox = font.getbbox(bottom_text, stroke_width=STROKE_WIDTH)
+        position = (
+            (width - (bbox[2] - bbox[0])) / 2,
+            height - (bbox[3] - bbox[1]) - MARGIN,
+        )
+        placed.append((bottom_text, position, bbox))
+    return placed
+
+
+def render_meme(
+    font_path,
+    top_text,
+    bottom_text,
+    font_size=FONT_SIZE,
+    compression=MEME_PNG_COMPRESSION,
+):
+    # Always the full canvas: VTube Studio sizes and pins the item assuming
+    # an 800x600 image, so a smaller one would change how the meme looks
+    font = load_font(font_path, font_size)
+    image = Image.new("RGBA", (IMAGE_WIDTH, IMAGE_HEIGHT), (255, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    for text, position, _ in layout(font, top_text, bottom_text):
+        draw.text(
+            position,
+            text,
+            font=font,
+            fill=TEXT_COLOR,
+            stroke_width=STROKE_WIDTH,
+            stroke_fill=BORDER_COLOR,
+        )
+
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", compress_level=compression)
+    return buffer.getvalue()
+
+
+# Rendered meme PNGs keyed by text and style, least recently used first out.
+# render_async draws in a pool of worker processes so Pillow never runs on
+# the event loop, with at most max_pending renders queued or running.
+class MemeRenderer:
+    def __init__(
+        self,
+        font_path,
+        font_size=FONT_SIZE,
+        entries=MEME_CACHE_ENTRIES,
+        workers=MEME_RENDER_WORKERS,
+        max_pending=MEME_RENDER_MAX_PENDING,
+    ):
+        self.font_path = font_path
+        self.font_size = font_size
+        self.entries = entries
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.workers = workers
+        self.pool = None
+        self.slots = asyncio.Semaphore(max(max_pending, 1))
+        # Identical memes requested together share one render
+        self.rendering = {}
+
+    def start(self):
+        if self.workers <= 0 or self.pool:
+            return
+        # Spawned rather than forked, since the bot process runs threads
+        self.pool = ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_worker,
+            initargs=(self.font_path, self.font_size),
+        )
+        for _ in range(self.workers):
+            self.pool.submit(int)
+
+    def key(self, top_text, bottom_text):
+        return (top_text, bottom_text, self.font_path, self.font_size)
+
+    async def render_async(self, top_text, bottom_text):
+        key = self.key(top_text, bottom_text)
+        with self.lock:
+            png = self.images.get(key)
+            if png is not None:
+                self.images.move_to_end(key)
+                self.hits += 1
+                return png
+            self.misses += 1
+
+        rendering = self.rendering.get(key)
+        if not rendering:
+            rendering = asyncio.ensure_future(
+                self.render_pooled(key, top_text, bottom_text)
+            )
+            self.rendering[key] = rendering
+        # A cancelled !meme must not cancel the render others are waiting on
+        return await asyncio.shield(rendering)
+
+    async def render_pooled(self, key, top_text, bottom_text):
+        try:
+            async with self.slots:
+                # Without a pool the render still moves off the event loop,
+                # onto the default thread pool
+                png = await asyncio.get_running_loop().run_in_executor(
+                    self.pool,
+                    render_meme,
+                    self.font_path,
+                    top_text,
+                    bottom_text,
+                    self.font_size,
+                    MEME_PNG_COMPRESSION,
+                )
+            self.store(key, png)
+            return png
+        finally:
+            self.rendering.pop(key, None)
+
+    def store(self, key, png):
+        if self.entries <= 0:
+            return
+        with self.lock:
+            self.images[key] = png
+            self.images.move_to_end(key)
+            while len(self.images) > self.entries:
+                self.images.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.images),
+                "bytes": sum(len(png) for png in self.images.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "workers": self.workers,
+                "rendering": len(self.rendering),
+            }
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
@@ -0,0 +1,150 @@
+import asyncio
+import glob
+import heapq
+import itertools
+import os
+from cogs.logging import logger
+from cogs.vts_client import VTSError
+
+MEME_LIFETIME = float(os.getenv("MEME_LIFETIME", 10))
+MEME_MAX_ITEMS = int(os.getenv("MEME_MAX_ITEMS", 10))
+# Items expiring this close together are unloaded in one request
+MEME_UNLOAD_BATCH_WINDOW = 0.25
+# Meme images and the temp files they are written through
+MEME_FILE_PATTERNS = ("meme_image_*.png", "meme_image_*.png.*.tmp")
+
+
+# Tracks every meme item on screen in a heap ordered by expiry. One task
+# sleeps until the earliest expiry and unloads everything due in a single
+# ItemUnloadRequest, so memes never hold a coroutine for their lifetime.
+# Image files are reference counted and deleted once no item shows them.
+class ItemScheduler:
+    def __init__(
+        self,
+        unload,
+        directory,
+        lifetime=MEME_LIFETIME,
+        max_items=MEME_MAX_ITEMS,
+    ):
+        # unload(instance_ids) sends one ItemUnloadRequest for all of them
+        self.unload = unload
+        self.directory = directory
+        self.lifetime = lifetime
+        self.max_items = max_items
+        self.heap = []
+        self.files = {}
+        self.counter = itertools.count()
+        self.changed = asyncio.Event()
+        self.task = None
+        self.unloaded = 0
+        self.unload_requests = 0
+        self.evicted = 0
+        self.files_removed = 0
+
+    def start(self):
+        if not self.task:
+            self.collect_garbage()
+            self.task = asyncio.create_task(self.run())
+
+    def collect_garbage(self):
+        # Files left behind by earlier runs, including the old random names
+        for pattern in MEME_FILE_PATTERNS:
+            for path in glob.glob(os.path.join(self.directory, pattern)):
+                if path not in self.files:
+                    self.remove_file(path)
+
+    def hold(self, path):
+        # Taken before the file is written, so an expiring item using the
+        # same image cannot delete it between the write and the load
+        self.files[path] = self.files.get(path, 0) + 1
+
+    def release(self, path):
+        count = self.files.get(path, 0) - 1
+        if count > 0:
+            self.files[path] = count
+            return
+        self.files.pop(path, None)
+        self.remove_file(path)
+
+    def remove_file(self, path):
+        try:
+            os.remove(path)
+            self.files_removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove meme image {path}: {e}")
+
+    def add(self, instance_id, path, on_expire=None):
+        # Takes over the caller's hold on path
+        expires_at = asyncio.get_running_loop().time() + self.lifetime
+        heapq.heappush(
+            self.heap, (expires_at, next(self.counter), instance_id, path, on_expire)
+        )
+        self.changed.set()
+
+        if self.max_items > 0 and len(self.heap) > self.max_items:
+            # Over the cap the items closest to expiry make way immediately
+            evicted = [
+                heapq.heappop(self.heap) for _ in range(len(self.heap) - self.max_items)
+            ]
+            self.evicted += len(evicted)
+            asyncio.create_task(self.expire(evicted))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self.changed.clear()
+            if not self.heap:
+                await self.changed.wait()
+                continue
+
+            delay = self.heap[0][0] - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            cutoff = loop.time() + MEME_UNLOAD_BATCH_WINDOW
+            due = []
+            while self.heap and self.heap[0][0] <= cutoff:
+                due.append(heapq.heappop(self.heap))
+            await self.expire(due)
+
+    async def expire(self, entries):
+        instance_ids = [entry[2] for entry in entries]
+        try:
+            self.unloaded += await self.unload(instance_ids)
+            self.unload_requests += 1
+        except (VTSError, ConnectionError, asyncio.TimeoutError) as e:
+            logger.warning(f"Failed to unload meme items: {e!r}")
+
+        for _, _, _, path, on_expire in entries:
+            self.release(path)
+            if on_expire:
+                try:
+                    await on_expire()
+                except Exception as e:
+                    logger.error(f"Meme expiry callback failed: {e!r}")
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        entries, self.heap = self.heap, []
+        if entries:
+            await self.expire(entries)
+
+    def stats(self):
+        return {
+            "active": len(self.heap),
+            "max_items": self.max_items,
+            "files": len(self.files),
+            "unloaded": self.unloaded,
+            "unload_requests": self.unload_requests,
+            "evicted": self.evicted,
+            "files_removed": self.files_removed,
+        }
@@ -0,0 +1,113 @@
+import asyncio
+from cogs.logging import logger
+
+
+# Delivers each chat message only to the handlers that asked for it. Author
+# and command prefix subscriptions are looked up in dicts, so a message costs
+# one lookup per index however many chatters are being followed; predicates and
+# catch-all handlers are the only ones consulted for every message.
+class MessageRouter:
+    def __init__(self):
+        self.authors = {}
+        # Prefixes are bucketed by their first character
+        self.prefixes = {}
+        self.predicates = []
+        self.everything = []
+        self.tasks = set()
+        self.dispatched = 0
+        self.delivered = 0
+        self.errors = 0
+
+    def subscribe(self, handler, author=None, prefix=None, predicate=None):
+        # Returns a route to pass to unsubscribe; with no filter the handler
+        # receives every message
+        if author is not None:
+            route = ("author", author.lower(), handler)
+            self.authors.setdefault(route[1], []).append(handler)
+        elif prefix:
+            route = ("prefix", prefix, handler)
+            self.prefixes.setdefault(prefix[0], []).append((prefix, handler))
+        elif predicate is not None:
+            route = ("predicate", predicate, handler)
+            self.predicates.append((predicate, handler))
+        else:
+            route = ("everything", None, handler)
+            self.everything.append(handler)
+        return route
+
+    def unsubscribe(self, route):
+        kind, key, handler = route
+        if kind == "author":
+            handlers = self.authors.get(key, [])
+            if handler in handlers:
+                handlers.remove(handler)
+            if not handlers:
+                self.authors.pop(key, None)
+        elif kind == "prefix":
+            bucket = self.prefixes.get(key[0], [])
+            if (key, handler) in bucket:
+                bucket.remove((key, handler))
+            if not bucket:
+                self.prefixes.pop(key[0], None)
+        elif kind == "predicate":
+            if (key, handler) in self.predicates:
+                self.predicates.remove((key, handler))
+        elif handler in self.everything:
+            self.everything.remove(handler)
+
+    def match(self, message):
+        handlers = list(self.everything)
+
+        if message.author and self.authors:
+            handlers.extend(self.authors.get(message.author.name.lower(), ()))
+
+        content = message.content
+        if content and self.prefixes:
+            for prefix, handler in self.prefixes.get(content[0], ()):
+                if content.startswith(prefix):
+                    handlers.append(handler)
+
+        for predicate, handler in self.predicates:
+            if predicate(message):
+                handlers.append(handler)
+
+        return handlers
+
+    def dispatch(self, message):
+        # Coroutine handlers run as tasks, as twitchio runs event listeners,
+        # so a slow handler never holds up the others
+        self.dispatched += 1
+        handlers = self.match(message)
+        for handler in handlers:
+            try:
+                result = handler(message)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Message handler {handler.__qualname__} failed: {e}")
+                continue
+
+            if asyncio.iscoroutine(result):
+                task = asyncio.create_task(result)
+                self.tasks.add(task)
+                task.add_done_callback(self.task_done)
+
+        self.delivered += len(handlers)
+        return len(handlers)
+
+    def task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            self.errors += 1
+            logger.error(f"Message handler failed: {task.exception()}")
+
+    def stats(self):
+        return {
+            "authors": len(self.authors),
+            "prefixes": sum(len(bucket) for bucket in self.prefixes.values()),
+            "predicates": len(self.predicates),
+            "everything": len(self.everything),
+            "dispatched": self.dispatched,
+            "delivered": self.delivered,
+            "errors": self.errors,
+            "running": len(self.tasks),
+        }
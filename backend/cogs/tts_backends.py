@@ -0,0 +1,228 @@
+import io
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import zlib
+import numpy as np
+import soundfile as sf
+from elevenlabs.client import ElevenLabs
+from cogs.logging import logger
+from cogs.tts_cache import TTSCache
+
+# Every backend streams 16-bit mono PCM at this rate, either as raw
+# little-endian bytes or as int16 arrays when it has already decoded them
+TTS_SAMPLE_RATE = 22050
+TTS_BACKEND = os.getenv("TTS_BACKEND", "elevenlabs")
+TTS_FALLBACK_BACKEND = os.getenv("TTS_FALLBACK_BACKEND", "")
+TTS_FAILOVER_TIMEOUT = float(os.getenv("TTS_FAILOVER_TIMEOUT", 3))
+TTS_VOICE = os.getenv("TTS_VOICE", "Leonard")
+TTS_MODEL = os.getenv("TTS_MODEL", "eleven_multilingual_v2")
+TTS_LOCAL_VOICE = os.getenv("TTS_LOCAL_VOICE", "en")
+TTS_MOCK_CHARS_PER_SECOND = float(os.getenv("TTS_MOCK_CHARS_PER_SECOND", 15))
+TTS_MOCK_LATENCY = float(os.getenv("TTS_MOCK_LATENCY", 0))
+TTS_MOCK_SPEED = float(os.getenv("TTS_MOCK_SPEED", 0))
+CHUNK_SAMPLES = TTS_SAMPLE_RATE // 10
+
+
+class SynthesisBackend:
+    name = None
+    cacheable = True
+    sample_rate = TTS_SAMPLE_RATE
+
+    def __init__(self, voice, model):
+        self.voice = voice
+        self.model = model
+
+    def cache_key(self, text):
+        return TTSCache.key(text, self.voice, self.model)
+
+    def open(self, text):
+        # Returns the backend that actually serves the request along with its
+        # PCM chunks, so failover audio is never cached under the primary key
+        return self, self.stream(text)
+
+    def stream(self, text):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"name": self.name, "voice": self.voice, "model": self.model}
+
+
+class ElevenLabsBackend(SynthesisBackend):
+    name = "elevenlabs"
+
+    def __init__(self, voice=TTS_VOICE, model=TTS_MODEL):
+        super().__init__(voice, model)
+        self.client = ElevenLabs(api_key=os.getenv("ELEVEN_API_KEY"))
+
+    def stream(self, text):
+        # Raw PCM streams straight to the output device without a decode step
+        return self.client.generate(
+            text=text,
+            voice=self.voice,
+            model=self.model,
+            stream=True,
+            output_format=f"pcm_{self.sample_rate}",
+        )
+
+
+class LocalBackend(SynthesisBackend):
+    name = "local"
+
+    def __init__(self, voice=TTS_LOCAL_VOICE):
+        super().__init__(voice, "espeak-ng")
+        self.command = shutil.which("espeak-ng") or shutil.which("espeak")
+        if not self.command:
+            logger.warning("espeak-ng is not installed, local TTS is unavailable")
+
+    def stream(self, text):
+        if not self.command:
+            raise RuntimeError("No local TTS engine installed")
+
+        result = subprocess.run(
+            [self.command, "-v", self.voice, "--stdin", "--stdout"],
+            input=text.encode("utf-8"),
+            capture_output=True,
+            check=True,
+            timeout=30,
+        )
+        samples, rate = sf.read(io.BytesIO(result.stdout), dtype="int16")
+        if samples.ndim > 1:
+            samples = samples[:, 0]
+        if rate != self.sample_rate:
+            positions = np.arange(0, len(samples), rate / self.sample_rate)
+            samples = np.interp(positions, np.arange(len(samples)), samples)
+
+        samples = samples.astype("<i2", copy=False)
+        for start in range(0, len(samples), CHUNK_SAMPLES):
+            yield samples[start : start + CHUNK_SAMPLES]
+
+
+# Generates a tone whose length and pitch depend only on the text, for load
+# testing the pipeline without network access
+class MockBackend(SynthesisBackend):
+    name = "mock"
+    cacheable = False
+
+    def __init__(
+        self,
+        chars_per_second=TTS_MOCK_CHARS_PER_SECOND,
+        latency=TTS_MOCK_LATENCY,
+        speed=TTS_MOCK_SPEED,
+    ):
+        super().__init__("mock", "mock")
+        self.chars_per_second = chars_per_second
+        self.latency = latency
+        self.speed = speed
+
+    def duration(self, text):
+        return max(0.25, len(text) / self.chars_per_second)
+
+    def stream(self, text):
+        pitch = 110 + zlib.crc32(text.encode("utf-8")) % 110
+        total = int(self.duration(text) * self.sample_rate)
+        if self.latency:
+            time.sleep(self.latency)
+
+        for start in range(0, total, CHUNK_SAMPLES):
+            t = np.arange(start, min(total, start + CHUNK_SAMPLES)) / self.sample_rate
+            # Modulated at roughly syllable rate so the envelope has shape
+            tone = np.sin(2 * np.pi * pitch * t) * (
+                0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+            )
+            if self.speed:
+                time.sleep(len(t) / self.sample_rate / self.speed)
+            yield (tone * 12000).astype("<i2")
+
+
+# Serves from the primary backend unless it fails or has not produced its
+# first chunk within the timeout, in which case the fallback takes over
+class FailoverBackend(SynthesisBackend):
+    def __init__(self, primary, fallback, timeout=TTS_FAILOVER_TIMEOUT):
+        super().__init__(primary.voice, primary.model)
+        self.name = f"{primary.name}+{fallback.name}"
+        self.cacheable = primary.cacheable
+        self.primary = primary
+        self.fallback = fallback
+        self.timeout = timeout
+        self.failovers = 0
+
+    def cache_key(self, text):
+        return self.primary.cache_key(text)
+
+    def open(self, text):
+        chunks = queue.Queue()
+        abandoned = threading.Event()
+        threading.Thread(
+            target=self.pump,
+            args=(text, chunks, abandoned),
+            name="tts-failover",
+            daemon=True,
+        ).start()
+
+        try:
+            first = chunks.get(timeout=self.timeout)
+            if isinstance(first, Exception):
+                raise first
+        except Exception as e:
+            abandoned.set()
+            self.failovers += 1
+            reason = "timed out" if isinstance(e, queue.Empty) else e
+            logger.warning(
+                f"{self.primary.name} TTS {reason}, using {self.fallback.name}"
+            )
+            return self.fallback.open(text)
+
+        return self.primary, self.drain(first, chunks, abandoned)
+
+    def pump(self, text, chunks, abandoned):
+        source = self.primary.stream(text)
+        try:
+            for chunk in source:
+                if abandoned.is_set():
+                    break
+                chunks.put(chunk)
+            chunks.put(None)
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            if hasattr(source, "close"):
+                source.close()
+
+    def drain(self, first, chunks, abandoned):
+        try:
+            chunk = first
+            while chunk is not None:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+                chunk = chunks.get()
+        finally:
+            abandoned.set()
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "primary": self.primary.stats(),
+            "fallback": self.fallback.stats(),
+            "failovers": self.failovers,
+        }
+
+
+BACKENDS = {
+    "elevenlabs": ElevenLabsBackend,
+    "local": LocalBackend,
+    "mock": MockBackend,
+}
+
+
+def create_backend(name=TTS_BACKEND, fallback=TTS_FALLBACK_BACKEND):
+    backend = BACKENDS[name]()
+    if fallback:
+        backend = FailoverBackend(backend, BACKENDS[fallback]())
+
+    logger.info(f"Using {backend.name} TTS backend")
+    return backend
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from cogs.logging import logger
+
+TTS_CACHE_DIR = os.path.expanduser(
+    os.getenv("TTS_CACHE_DIR", "~/.cache/beth-the-bot/tts")
+)
+TTS_CACHE_MAX_BYTES = int(float(os.getenv("TTS_CACHE_MAX_MB", 256)) * 1024 * 1024)
+TTS_CACHE_HOT_MAX_BYTES = int(float(os.getenv("TTS_CACHE_HOT_MB", 32)) * 1024 * 1024)
+CACHE_SUFFIX = ".npz"
+
+
+class CachedAudio:
+    def __init__(self, pcm, envelope, sample_rate, frame_rate):
+        self.pcm = pcm
+        self.envelope = envelope
+        self.sample_rate = sample_rate
+        self.frame_rate = frame_rate
+
+    @property
+    def size(self):
+        return self.pcm.nbytes + len(self.envelope)
+
+
+# Synthesized audio keyed by what was said and how. Recently used entries are
+# kept in memory, everything else lives on disk; both tiers are bounded and
+# evict the least recently used entry first.
+class TTSCache:
+    def __init__(
+        self,
+        directory=TTS_CACHE_DIR,
+        max_bytes=TTS_CACHE_MAX_BYTES,
+        hot_max_bytes=TTS_CACHE_HOT_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hot_max_bytes = hot_max_bytes
+        self.lock = threading.Lock()
+        self.hot = OrderedDict()
+        self.hot_bytes = 0
+        self.index = OrderedDict()
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            self.load_index()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(text, voice, model):
+        identity = json.dumps([text, voice, model], ensure_ascii=False)
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def load_index(self):
+        # Disk recency survives restarts through the file mtimes
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(CACHE_SUFFIX):
+                stat = entry.stat()
+                entries.append(
+                    (stat.st_mtime, entry.name[: -len(CACHE_SUFFIX)], stat.st_size)
+                )
+
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.disk_bytes += size
+
+        logger.info(
+            f"TTS cache loaded {len(self.index)} entries ({self.disk_bytes} bytes)"
+        )
+        with self.lock:
+            self.evict()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+
+        with self.lock:
+            entry = self.hot.get(key)
+            if entry:
+                self.hot.move_to_end(key)
+                self.index.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            if key not in self.index:
+                self.misses += 1
+                return None
+            self.index.move_to_end(key)
+
+        try:
+            entry = self.read(key)
+            os.utime(self.path(key))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Dropping unreadable TTS cache entry {key}: {e}")
+            with self.lock:
+                self.discard(key)
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+            self.remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        if not self.enabled or entry.size > self.max_bytes:
+            return
+
+        try:
+            size = self.write(key, entry)
+        except OSError as e:
+            logger.warning(f"Failed to write TTS cache entry {key}: {e}")
+            return
+
+        with self.lock:
+            self.disk_bytes += size - self.index.pop(key, 0)
+            self.index[key] = size
+            self.remember(key, entry)
+            self.evict()
+
+    def read(self, key):
+        with np.load(self.path(key)) as data:
+            sample_rate, frame_rate = data["rates"].tolist()
+            return CachedAudio(
+                data["pcm"],
+                data["envelope"].tobytes(),
+                sample_rate,
+                frame_rate,
+            )
+
+    def write(self, key, entry):
+        # Write to a temporary file first so a crash never leaves a torn entry
+        path = self.path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(
+                f,
+                pcm=entry.pcm,
+                envelope=np.frombuffer(entry.envelope, dtype=np.uint8),
+                rates=np.array([entry.sample_rate, entry.frame_rate]),
+            )
+        os.replace(temp_path, path)
+        return os.path.getsize(path)
+
+    def remember(self, key, entry):
+        self.hot_bytes += entry.size
+        previous = self.hot.pop(key, None)
+        if previous:
+            self.hot_bytes -= previous.size
+        self.hot[key] = entry
+
+        while self.hot_bytes > self.hot_max_bytes and self.hot:
+            _, evicted = self.hot.popitem(last=False)
+            self.hot_bytes -= evicted.size
+
+    def discard(self, key):
+        self.disk_bytes -= self.index.pop(key, 0)
+        entry = self.hot.pop(key, None)
+        if entry:
+            self.hot_bytes -= entry.size
+
+    def evict(self):
+        while self.disk_bytes > self.max_bytes and self.index:
+            key = next(iter(self.index))
+            self.discard(key)
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except OSError as e:
+                logger.warning(f"Failed to remove TTS cache entry {key}: {e}")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.index),
+                "disk_bytes": self.disk_bytes,
+                "hot_entries": len(self.hot),
+                "hot_bytes": self.hot_bytes,
+            }
@@ -1,37 +1,51 @@
 from twitchio.ext import commands
 from cogs.logging import logger
+from cogs.audio_worker import AudioWorker
+from cogs.audio_mixer import AudioMixer
+from cogs.guest_registry import GuestRegistry, SimpleChatter
+from cogs.guest_store import GuestStore
+from cogs.audio_envelope import TTS_ENVELOPE_FPS, encode_envelope
+from cogs.tts_cache import TTSCache
+from cogs.tts_queue import MessageQueue, QueuedMessage
+from cogs.tts_backends import TTS_SAMPLE_RATE, create_backend
+from cogs.tts_synthesis import TTS_PREFETCH, Synthesizer
+from cogs.tts_text import TextNormalizer, twitch_emote_names
 from collections import deque
-import random
 import asyncio
+import logging
 import os
-import pyaudio
 import wave
-import numpy as np
-import soundfile as sf
-import io
-from elevenlabs.client import ElevenLabs
-from elevenlabs import play
 from obswebsocket import obsws, requests
 from dotenv import load_dotenv
 
 
 load_dotenv()
 
-
-class SimpleChatter:
-    def __init__(self, name):
-        self.name = name
+TTS_MESSAGE_HOLD = float(os.getenv("TTS_MESSAGE_HOLD", 2))
+# How long unloading waits for the message being played to finish
+TTS_UNLOAD_TIMEOUT = 5
 
 
 class TTSGuestCog(commands.Cog):
     def __init__(self, bot, socketio):
         self.bot = bot
-        self.guest_list = []
+        self.guest_list = GuestRegistry()
         self.current_guest = None
-        self.message_queue = deque()
+        self.message_queue = MessageQueue()
+        self.prefetched = deque()
         self.socketio = socketio
         self.tts_playing = False
-        self.client = ElevenLabs(api_key=os.getenv("ELEVEN_API_KEY"))
+        self.clear_handle = None
+        self.guest_route = None
+        self.backend = create_backend()
+        self.mixer = AudioMixer(TTS_SAMPLE_RATE)
+        self.cache = TTSCache()
+        self.synthesizer = Synthesizer(self.backend, self.cache)
+        self.normalizer = TextNormalizer()
+        self.audio_worker = AudioWorker()
+        self.store = GuestStore()
+        self.restore()
+        self.store.start()
 
         if os.getenv("OBS_WEBSOCKET_PASSWORD"):
             self.obs_enabled = True
@@ -45,24 +59,127 @@ class TTSGuestCog(commands.Cog):
         else:
             self.obs_enabled = False
 
-    @commands.Cog.event()
-    async def event_message(self, message):
-        if message.echo:
-            return
+    def cog_unload(self):
+        if self.guest_route:
+            self.bot.router.unsubscribe(self.guest_route)
+            self.guest_route = None
+        if self.clear_handle:
+            self.clear_handle.cancel()
+        while self.prefetched:
+            self.prefetched.popleft()[1].cancel()
+        self.synthesizer.close()
+        self.mixer.close()
+        self.audio_worker.stop(TTS_UNLOAD_TIMEOUT)
+        self.store.close()
 
-        if self.current_guest and message.author.name == self.current_guest[0].name:
-            logger.info(f"Message from current guest: {message.content}")
+    def restore(self):
+        guests, current_guest, messages = self.store.load()
+        self.set_current_guest(current_guest)
+        for chatter, timestamp in guests:
+            self.guest_list.add(chatter, timestamp)
+        for message in messages:
             self.message_queue.append(message)
-            await self.process_queue()
+
+    def save_queue(self):
+        # Messages handed to synthesis are kept until playback takes them
+        self.store.set_queue(
+            [message for message, _ in self.prefetched] + list(self.message_queue)
+        )
+
+    def set_current_guest(self, guest):
+        # Only the current guest's messages are routed to this cog
+        if self.guest_route:
+            self.bot.router.unsubscribe(self.guest_route)
+            self.guest_route = None
+
+        self.current_guest = guest
+        if guest:
+            self.guest_route = self.bot.router.subscribe(
+                self.guest_message, author=guest[0].name
+            )
+
+    async def guest_message(self, message):
+        guest = self.current_guest
+        if not guest:
+            return
+
+        logger.info(f"Message from current guest: {message.content}")
+        text = self.normalizer.normalize(message.content, twitch_emote_names(message))
+        if not text:
+            logger.debug("Nothing left to say after normalization")
+            return
+
+        # Only the spoken form is kept, not the twitchio message
+        queued = QueuedMessage(guest[0], text, message.timestamp)
+        self.apply_policy_to_prefetched(queued)
+        if self.message_queue.append(queued):
+            self.prefetch()
+            self.save_queue()
+        await self.process_queue()
+
+    def prefetch(self):
+        # Start synthesizing upcoming messages while the current one plays;
+        # playback still consumes them strictly in order
+        while self.message_queue and len(self.prefetched) < TTS_PREFETCH:
+            message = self.message_queue.popleft()
+            if message:
+                self.prefetched.append(
+                    (message, self.synthesizer.submit(message.content))
+                )
+
+    def apply_policy_to_prefetched(self, queued):
+        # Prefetched messages are still subject to the queue policy: latest
+        # skips them, and coalesce takes the last one back to merge into it
+        queue = self.message_queue
+        if queue.policy == "latest":
+            while self.prefetched:
+                message, job = self.prefetched.popleft()
+                job.cancel()
+                queue.dropped += 1
+                logger.info(f"Newer TTS message, skipped: {message.content}")
+        elif queue.policy == "coalesce" and self.prefetched and not queue:
+            last, _ = self.prefetched[-1]
+            if len(last.content) + len(queued.content) < queue.coalesce_max_chars:
+                self.prefetched.pop()[1].cancel()
+                queue.requeue(last)
 
     async def process_queue(self):
-        if not self.tts_playing and self.message_queue:
+        if not self.tts_playing and (self.message_queue or self.prefetched):
             self.tts_playing = True
-            while self.message_queue:
-                message = self.message_queue.popleft()
-                await self.handle_message(message.content)
+            if self.clear_handle:
+                self.clear_handle.cancel()
+
+            while self.prefetched or self.message_queue:
+                if self.prefetched:
+                    message, job = self.prefetched.popleft()
+                    if not self.message_queue.fresh(message):
+                        job.cancel()
+                        self.save_queue()
+                        continue
+                else:
+                    message = self.message_queue.popleft()
+                    if not message:
+                        continue
+                    job = self.synthesizer.submit(message.content)
+                self.prefetch()
+                self.save_queue()
+                await self.handle_message(job)
             self.tts_playing = False
 
+            # Keep the last message on screen for a moment unless another starts
+            self.clear_handle = asyncio.get_running_loop().call_later(
+                TTS_MESSAGE_HOLD, self.clear_message
+            )
+
+    def clear_message(self):
+        self.clear_handle = None
+        if not self.tts_playing:
+            self.socketio.emit(
+                "message_update",
+                {"message": ""},
+                namespace="/",
+            )
+
     def set_obs_source_visibility(self, scene_name, source_name, source_visible=True):
         if self.obs_enabled:
             response = self.obs_client.call(
@@ -80,13 +197,13 @@ class TTSGuestCog(commands.Cog):
     def set_tts_avatar_visibility(self, visibility):
         self.set_obs_source_visibility("Just Chatting", "TTSAvatar", visibility)
 
-    async def handle_message(self, text):
+    async def handle_message(self, job):
         try:
             # Update frontend and OBS
             # self.set_obs_source_visibility("Just Chatting", "TTSAvatar", True)
 
             # Play the TTS
-            await self.play_tts(text)
+            await self.play_tts(job)
 
             # Clear the message from the frontend and OBS after playback
             # if len(self.message_queue) == 0:
@@ -94,92 +211,121 @@ class TTSGuestCog(commands.Cog):
         except Exception as e:
             logger.error(f"Failed to handle message: {e}")
 
-    async def play_tts(self, text):
+    async def play_tts(self, job):
         try:
-            # Call the ElevenLabs API to generate the TTS audio
-            audio = self.client.generate(
-                text=text, voice="Leonard", model="eleven_multilingual_v2"
-            )
-            audio_data = [f for f in audio]
-
-            amplitudes = self.calculate_amplitudes(audio_data)
+            # Playback blocks, so it runs on the audio worker while the event
+            # loop keeps serving chat
+            duration = await self.audio_worker.run(self.stream_tts, job)
+            logger.debug("Played %.2fs of TTS", duration)
+        except Exception as e:
+            logger.error(f"Failed to play TTS: {e}")
 
+    def stream_tts(self, job):
+        source = None
+        try:
             self.socketio.emit(
                 "message_update",
-                {"message": text, "amplitudes": amplitudes},
+                {
+                    "message": job.text,
+                    "envelope": encode_envelope(b""),
+                    "frame_rate": TTS_ENVELOPE_FPS,
+                },
                 namespace="/",
             )
 
-            # Play the audio using ElevenLabs' play function
-            await asyncio.sleep(0.4)
-            play(b"".join(audio_data))
+            # Speech ducks anything else playing through the mixer
+            source = self.mixer.add_source("tts", duck_others=True)
+
+            samples = 0
+            for pcm, envelope in job:
+                self.emit_envelope(envelope)
+                if not pcm.size:
+                    continue
 
-            # Wait for the duration of the audio to finish playback
-            duration = len(audio_data) / 22050 + 2
-            await asyncio.sleep(duration)
+                if not samples:
+                    # The first sample is heard once the mixer latency elapses
+                    self.socketio.emit(
+                        "playback_started",
+                        {"latency": self.mixer.latency},
+                        namespace="/",
+                    )
+                if not source.write(pcm):
+                    # The output stopped reading; give up on this message
+                    logger.warning("Audio output stalled, TTS playback abandoned")
+                    job.cancel()
+                    return samples / TTS_SAMPLE_RATE
+                samples += pcm.size
 
+            # The mixer reports when the last sample has reached the device,
+            # so the clock below matches what was actually heard
+            source.close()
+            duration = samples / TTS_SAMPLE_RATE
+            if not self.mixer.wait(source, duration + self.mixer.latency + 1):
+                # The stream stopped calling back; give up on this message
+                logger.warning("Audio output stalled, TTS playback abandoned")
+                source.cancel()
             self.socketio.emit(
-                "message_update",
-                {"message": ""},
+                "playback_finished",
+                {"duration": duration},
                 namespace="/",
             )
-        except Exception as e:
-            logger.error(f"Failed to play TTS: {e}")
-
-    def calculate_amplitudes(self, audio_data):
-        audio_array, _ = sf.read(io.BytesIO(b"".join(audio_data)))
-        amplitudes = np.abs(audio_array)
-        max_amplitude = np.max(amplitudes)
-        normalized_amplitudes = amplitudes / max_amplitude
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("TTS cache: %s", self.cache.stats())
+            return duration
+        finally:
+            if source:
+                source.close()
 
-        return normalized_amplitudes.tolist()
+    def emit_envelope(self, envelope):
+        if envelope:
+            self.socketio.emit(
+                "message_envelope",
+                {"envelope": encode_envelope(envelope)},
+                namespace="/",
+            )
 
     @commands.command()
     async def guest(self, ctx):
-        if ctx.author.name in [guest[0].name for guest in self.guest_list]:
+        if ctx.author.name in self.guest_list:
             logger.info(
                 f"{ctx.author.name} is already in the guest list, updating their timestamp."
             )
-            self.guest_list = [
-                (
-                    (guest[0], ctx.message.created_at)
-                    if guest[0].name == ctx.author.name
-                    else guest
-                )
-                for guest in self.guest_list
-            ]
+            self.guest_list.add(SimpleChatter(ctx.author.name), ctx.message.timestamp)
+            self.store.join(ctx.author.name, ctx.message.timestamp)
             return
 
         if self.current_guest and ctx.author.name == self.current_guest[0].name:
             logger.info(f"{ctx.author.name} is the current guest.")
             return
 
-        self.guest_list.append((ctx.author, ctx.message.created_at))
+        self.guest_list.add(SimpleChatter(ctx.author.name), ctx.message.timestamp)
+        self.store.join(ctx.author.name, ctx.message.timestamp)
 
     def pick_guest(self):
-        if self.guest_list:
-            self.current_guest = random.choice(self.guest_list)
-            self.guest_list = [
-                guest
-                for guest in self.guest_list
-                if guest[0].name != self.current_guest[0].name
-            ]
+        guest = self.guest_list.pick()
+        if guest:
+            self.set_current_guest(guest)
+            self.store.leave(guest[0].name)
+            self.store.set_current(guest)
             return self.current_guest
         return None
 
     def clear_guest(self):
-        self.current_guest = None
+        self.set_current_guest(None)
         self.message_queue.clear()
+        while self.prefetched:
+            self.prefetched.popleft()[1].cancel()
+        self.store.set_current(None)
+        self.save_queue()
 
     def set_guest(self, guest_name):
-        guest = next(
-            (guest for guest in self.guest_list if guest[0].name == guest_name), None
-        )
+        guest = self.guest_list.remove(guest_name)
         if guest:
-            self.current_guest = guest
-            self.guest_list = [g for g in self.guest_list if g[0].name != guest_name]
+            self.set_current_guest(guest)
+            self.store.leave(guest_name)
         else:
             # Handle the case where the guest is not in the guest_list
             chatter = SimpleChatter(guest_name)
             guest_tuple = (chatter, None)
-            self.current_guest = guest_tuple
+            self.set_current_guest(guest_tuple)
+        self.store.set_current(self.current_guest)
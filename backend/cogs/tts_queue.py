@@ -0,0 +1,165 @@
+import datetime
+import os
+import sys
+from collections import deque
+from cogs.logging import logger
+from cogs.twitch_time import twitch_time
+
+TTS_QUEUE_MAX_DEPTH = int(os.getenv("TTS_QUEUE_MAX_DEPTH", 10))
+TTS_QUEUE_MAX_AGE = float(os.getenv("TTS_QUEUE_MAX_AGE", 60))
+TTS_QUEUE_POLICY = os.getenv("TTS_QUEUE_POLICY", "drop_oldest")
+TTS_COALESCE_MAX_CHARS = int(os.getenv("TTS_COALESCE_MAX_CHARS", 300))
+TTS_QUEUE_MAX_BYTES = int(os.getenv("TTS_QUEUE_MAX_BYTES", 64 * 1024))
+
+# drop_oldest: make room by discarding the oldest queued message
+# drop_newest: refuse new messages while the queue is full
+# coalesce: append new text to the last queued message so it is synthesized
+#   in one request, falling back to drop_oldest once that gets too long
+# latest: skip everything queued and keep only the newest message
+POLICIES = ("drop_oldest", "drop_newest", "coalesce", "latest")
+
+
+# The only parts of a twitchio Message the queue needs, copied out at admission
+# so the message, its tags and its channel can be freed straight away
+class QueuedMessage:
+    __slots__ = ("author", "content", "timestamp")
+
+    def __init__(self, author, content, timestamp):
+        self.author = author
+        self.content = content
+        self.timestamp = timestamp
+
+    @property
+    def size(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.content)
+
+
+def message_age(message, now=None):
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return (now - twitch_time(message.timestamp)).total_seconds()
+
+
+# Admission control for the guest's pending messages, so a fast typist cannot
+# push speech minutes behind live chat
+class MessageQueue:
+    def __init__(
+        self,
+        max_depth=TTS_QUEUE_MAX_DEPTH,
+        max_age=TTS_QUEUE_MAX_AGE,
+        policy=TTS_QUEUE_POLICY,
+        coalesce_max_chars=TTS_COALESCE_MAX_CHARS,
+        max_bytes=TTS_QUEUE_MAX_BYTES,
+    ):
+        if policy not in POLICIES:
+            logger.warning(f"Unknown queue policy {policy}, using drop_oldest")
+            policy = "drop_oldest"
+
+        self.messages = deque()
+        self.max_depth = max_depth
+        self.max_age = max_age
+        self.policy = policy
+        self.coalesce_max_chars = coalesce_max_chars
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.admitted = 0
+        self.dropped = 0
+        self.expired = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __bool__(self):
+        return bool(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def append(self, message):
+        self.expire()
+
+        if self.policy == "latest" and self.messages:
+            self.dropped += len(self.messages)
+            self.clear()
+        elif self.policy == "coalesce" and self.messages:
+            last = self.messages[-1]
+            content = f"{last.content} {message.content}"
+            if len(content) <= self.coalesce_max_chars:
+                self.bytes -= last.size
+                last.content = content
+                self.bytes += last.size
+                self.admitted += 1
+                self.coalesced += 1
+                return True
+
+        size = message.size
+        while self.messages and (
+            len(self.messages) >= self.max_depth
+            or (self.max_bytes and self.bytes + size > self.max_bytes)
+        ):
+            if self.policy == "drop_newest":
+                self.dropped += 1
+                logger.info(f"TTS queue full, dropped: {message.content}")
+                return False
+
+            dropped = self.take()
+            self.dropped += 1
+            logger.info(f"TTS queue full, dropped: {dropped.content}")
+
+        self.messages.append(message)
+        self.bytes += size
+        self.admitted += 1
+        return True
+
+    def take(self):
+        message = self.messages.popleft()
+        self.bytes -= message.size
+        return message
+
+    def popleft(self):
+        # Returns None when everything left in the queue has expired
+        self.expire()
+        return self.take() if self.messages else None
+
+    def requeue(self, message):
+        # Puts a message taken out earlier back at the front
+        self.messages.appendleft(message)
+        self.bytes += message.size
+
+    def fresh(self, message):
+        # For messages already taken out of the queue; counts them as expired
+        # when they are too old to be spoken
+        if self.max_age <= 0 or message_age(message) <= self.max_age:
+            return True
+        self.expired += 1
+        logger.info(f"TTS message too old, skipped: {message.content}")
+        return False
+
+    def expire(self):
+        if self.max_age <= 0:
+            return
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        while self.messages and message_age(self.messages[0], now) > self.max_age:
+            expired = self.take()
+            self.expired += 1
+            logger.info(f"TTS message too old, skipped: {expired.content}")
+
+    def clear(self):
+        self.messages.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {
+            "depth": len(self.messages),
+            "max_depth": self.max_depth,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "max_age": self.max_age,
+            "policy": self.policy,
+            "admitted": self.admitted,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "coalesced": self.coalesced,
+            "oldest_age": (message_age(self.messages[0]) if self.messages else 0.0),
+        }
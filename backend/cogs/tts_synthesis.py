@@ -0,0 +1,159 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from cogs.logging import logger
+from cogs.audio_envelope import EnvelopeFollower
+from cogs.tts_cache import CachedAudio
+from cogs.tts_text import split_segments
+
+TTS_PREFETCH = int(os.getenv("TTS_PREFETCH", 2))
+TTS_SYNTHESIS_WORKERS = int(os.getenv("TTS_SYNTHESIS_WORKERS", 4))
+
+_DONE = object()
+EMPTY_PCM = np.empty(0, dtype="<i2")
+
+
+# Turns backend chunks into int16 sample arrays. Raw bytes are viewed in place
+# rather than copied, and a sample split across two chunks is carried over.
+class PCMDecoder:
+    def __init__(self):
+        self.remainder = b""
+
+    def decode(self, chunk):
+        if isinstance(chunk, np.ndarray):
+            return chunk.astype("<i2", copy=False)
+
+        if self.remainder:
+            chunk = self.remainder + chunk
+            self.remainder = b""
+
+        usable = len(chunk) - len(chunk) % 2
+        if usable < len(chunk):
+            self.remainder = chunk[usable:]
+        return np.frombuffer(chunk, dtype="<i2", count=usable // 2)
+
+
+# One message being synthesized in the background. Chunks are buffered as they
+# arrive so synthesis can run ahead of playback, and iterating the job replays
+# them in order, blocking until the next one is available.
+class SynthesisJob:
+    def __init__(self, text):
+        self.text = text
+        self.chunks = queue.Queue()
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def run(self, source):
+        try:
+            for chunk in source:
+                if self.cancelled.is_set():
+                    source.close()
+                    logger.debug(f"Synthesis cancelled: {self.text}")
+                    break
+                self.chunks.put(chunk)
+        except Exception as e:
+            self.chunks.put(e)
+        finally:
+            self.chunks.put(_DONE)
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.future and self.future.cancel():
+            self.chunks.put(_DONE)
+
+    def __iter__(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is _DONE:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+# A message split into segments that are synthesized concurrently and played
+# back to back in their original order
+class SegmentedJob:
+    def __init__(self, text, segments):
+        self.text = text
+        self.segments = segments
+
+    def cancel(self):
+        for segment in self.segments:
+            segment.cancel()
+
+    def __iter__(self):
+        for segment in self.segments:
+            yield from segment
+
+
+class Synthesizer:
+    def __init__(self, backend, cache, workers=TTS_SYNTHESIS_WORKERS):
+        self.backend = backend
+        self.cache = cache
+        # Shared by the segments of the message being played and of the ones
+        # synthesized ahead of it; submission order keeps the current message
+        # first in line
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="tts-synthesis"
+        )
+
+    def submit(self, text):
+        segments = [self.submit_segment(segment) for segment in split_segments(text)]
+        if len(segments) == 1:
+            return segments[0]
+        return SegmentedJob(text, segments)
+
+    def submit_segment(self, text):
+        job = SynthesisJob(text)
+        job.future = self.executor.submit(job.run, self.stream(text))
+        return job
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stream(self, text):
+        # Yields (samples, envelope) chunks, from the cache when this exact line
+        # has been spoken before and streamed from the backend otherwise. The
+        # decoded samples are shared as-is by the envelope, playback and cache.
+        key = self.backend.cache_key(text)
+        envelope = EnvelopeFollower(self.backend.sample_rate)
+        cached = self.cache.get(key) if self.backend.cacheable else None
+        if cached:
+            if cached.frame_rate == envelope.frame_rate:
+                yield cached.pcm, cached.envelope
+            else:
+                yield cached.pcm, envelope.feed(cached.pcm) + envelope.flush()
+            return
+
+        backend, audio = self.backend.open(text)
+
+        decoder = PCMDecoder()
+        pcm_chunks = []
+        envelope_chunks = []
+        for chunk in audio:
+            samples = decoder.decode(chunk)
+            if not samples.size:
+                continue
+
+            levels = envelope.feed(samples)
+            pcm_chunks.append(samples)
+            envelope_chunks.append(levels)
+            yield samples, levels
+
+        levels = envelope.flush()
+        envelope_chunks.append(levels)
+        yield EMPTY_PCM, levels
+
+        if backend.cacheable and backend.cache_key(text) == key:
+            self.cache.put(
+                key,
+                CachedAudio(
+                    np.concatenate(pcm_chunks) if pcm_chunks else EMPTY_PCM,
+                    b"".join(envelope_chunks),
+                    backend.sample_rate,
+                    envelope.frame_rate,
+                ),
+            )
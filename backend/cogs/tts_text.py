@@ -0,0 +1,154 @@
+import os
+import re
+import textwrap
+import time
+from cogs.logging import logger
+
+TTS_SEGMENT_MAX_CHARS = int(os.getenv("TTS_SEGMENT_MAX_CHARS", 160))
+TTS_SEGMENT_MIN_CHARS = int(os.getenv("TTS_SEGMENT_MIN_CHARS", 40))
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+")
+CLAUSE_BOUNDARY = re.compile(r"(?<=[,;:])\s+|\s+(?=[-–—]\s)")
+
+
+def split_segments(
+    text, max_chars=TTS_SEGMENT_MAX_CHARS, min_chars=TTS_SEGMENT_MIN_CHARS
+):
+    # Splits at sentence boundaries, then at clause boundaries or whitespace
+    # for sentences that are still too long
+    text = text.strip()
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text] if text else []
+
+    pieces = []
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+
+        for clause in CLAUSE_BOUNDARY.split(sentence):
+            pieces.extend(textwrap.wrap(clause, max_chars, break_long_words=False))
+
+    # Short interjections are merged into the preceding segment so they
+    # neither become a separate request nor lose their prosody
+    segments = []
+    for piece in pieces:
+        if not piece:
+            continue
+
+        if (
+            segments
+            and len(piece) < min_chars
+            and len(segments[-1]) + 1 + len(piece) <= max_chars
+        ):
+            segments[-1] = f"{segments[-1]} {piece}"
+        else:
+            segments.append(piece)
+
+    return segments
+
+
+TTS_EMOTES_PATH = os.path.expanduser(os.getenv("TTS_EMOTES_PATH", ""))
+TTS_EMOTES_REFRESH = float(os.getenv("TTS_EMOTES_REFRESH", 10))
+
+URL = re.compile(r"\b(?:https?://|www\.)(?:www\.)?([^\s/?#]+)\S*", re.IGNORECASE)
+REPEATED_CHARACTER = re.compile(r"(\D)\1{2,}")
+REPEATED_WORD = re.compile(r"\b(\w+)(?:\s+\1\b){2,}", re.IGNORECASE)
+WHITESPACE = re.compile(r"\s+")
+
+
+def twitch_emote_names(message):
+    # The emotes tag lists native Twitch emotes as id:start-end,start-end/...
+    tags = message.tags or {}
+    names = set()
+    for emote in filter(None, (tags.get("emotes") or "").split("/")):
+        _, _, ranges = emote.partition(":")
+        start, _, end = ranges.split(",")[0].partition("-")
+        if start.isdigit() and end.isdigit():
+            names.add(message.content[int(start) : int(end) + 1])
+    return names
+
+
+# Strips or substitutes emotes, collapses spam and shortens links before text
+# is sent for synthesis. The emote index is a plain dict keyed by token, since
+# chat emotes are always whitespace delimited, and it is reloaded whenever the
+# emotes file changes on disk.
+class TextNormalizer:
+    def __init__(self, emotes_path=TTS_EMOTES_PATH, refresh=TTS_EMOTES_REFRESH):
+        self.emotes_path = emotes_path
+        self.refresh = refresh
+        self.emotes = {}
+        self.emotes_mtime = None
+        self.checked_at = 0
+        self.messages = 0
+        self.chars_in = 0
+        self.chars_out = 0
+        self.emotes_removed = 0
+        self.links_shortened = 0
+        self.reload()
+
+    def reload(self):
+        if not self.emotes_path:
+            return
+
+        try:
+            mtime = os.path.getmtime(self.emotes_path)
+            if mtime == self.emotes_mtime:
+                return
+
+            emotes = {}
+            with open(self.emotes_path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith("#"):
+                        continue
+                    # "Name" is dropped, "Name = words" is spoken as the words
+                    name, _, replacement = line.partition("=")
+                    emotes[name.strip()] = replacement.strip()
+        except OSError as e:
+            logger.warning(f"Failed to load emotes from {self.emotes_path}: {e}")
+            return
+
+        self.emotes = emotes
+        self.emotes_mtime = mtime
+        logger.info(f"Loaded {len(emotes)} emotes from {self.emotes_path}")
+
+    def normalize(self, text, extra_emotes=()):
+        now = time.monotonic()
+        if now - self.checked_at > self.refresh:
+            self.checked_at = now
+            self.reload()
+
+        emotes = self.emotes
+        words = []
+        for word in text.split():
+            if word in emotes:
+                self.emotes_removed += 1
+                if emotes[word]:
+                    words.append(emotes[word])
+            elif word in extra_emotes:
+                self.emotes_removed += 1
+            else:
+                words.append(word)
+
+        normalized, links = URL.subn(r"\1 link", " ".join(words))
+        normalized = REPEATED_CHARACTER.sub(r"\1\1", normalized)
+        normalized = REPEATED_WORD.sub(r"\1 \1", normalized)
+        normalized = WHITESPACE.sub(" ", normalized).strip()
+
+        self.messages += 1
+        self.links_shortened += links
+        self.chars_in += len(text)
+        self.chars_out += len(normalized)
+        return normalized
+
+    def stats(self):
+        return {
+            "emotes": len(self.emotes),
+            "messages": self.messages,
+            "chars_in": self.chars_in,
+            "chars_out": self.chars_out,
+            "chars_saved": self.chars_in - self.chars_out,
+            "emotes_removed": self.emotes_removed,
+            "links_shortened": self.links_shortened,
+        }
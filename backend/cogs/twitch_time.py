@@ -0,0 +1,7 @@
+import datetime
+
+
+def twitch_time(timestamp):
+    # Twitch timestamps are naive UTC datetimes; returns an aware datetime,
+    # so .timestamp() gives epoch seconds
+    return timestamp.replace(tzinfo=datetime.timezone.utc)
@@ -0,0 +1,209 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import uuid
+import websockets
+from cogs.logging import logger
+
+VTS_REQUEST_TIMEOUT = float(os.getenv("VTS_REQUEST_TIMEOUT", 5))
+VTS_RECONNECT_MIN = float(os.getenv("VTS_RECONNECT_MIN", 1))
+VTS_RECONNECT_MAX = float(os.getenv("VTS_RECONNECT_MAX", 30))
+
+
+class VTSError(Exception):
+    def __init__(self, message_type, error_id, message):
+        super().__init__(f"{message_type} failed ({error_id}): {message}")
+        self.error_id = error_id
+
+
+# One VTube Studio API connection shared by any number of concurrent requests.
+# Every request gets a unique requestID, and a single reader task routes each
+# response to the future of the request it answers and each event to its
+# subscribers. Once started it keeps the session up, reconnecting with
+# exponential backoff; state is "disconnected", "connecting", "authenticating"
+# or "ready".
+class VTSClient:
+    def __init__(
+        self,
+        url,
+        timeout=VTS_REQUEST_TIMEOUT,
+        reconnect_min=VTS_RECONNECT_MIN,
+        reconnect_max=VTS_RECONNECT_MAX,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.websocket = None
+        self.reader = None
+        self.supervisor = None
+        self.state = "disconnected"
+        self.closing = False
+        self.pending = {}
+        self.subscribers = {}
+        # Unique across reconnects, so a late response can never be matched
+        # to a newer request
+        self.prefix = uuid.uuid4().hex[:8]
+        self.counter = itertools.count(1)
+        self.requests = 0
+        self.timeouts = 0
+        self.events = 0
+        self.connects = 0
+
+    @property
+    def connected(self):
+        return self.reader is not None and not self.reader.done()
+
+    @property
+    def ready(self):
+        return self.state == "ready" and self.connected
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url)
+        self.reader = asyncio.create_task(self.read())
+
+    def start(self, on_connect, on_ready=None):
+        # on_connect authenticates a fresh connection and raises if it cannot;
+        # on_ready runs once subscriptions are renewed, to resync local state
+        if not self.supervisor:
+            self.supervisor = asyncio.create_task(self.run(on_connect, on_ready))
+
+    async def run(self, on_connect, on_ready):
+        delay = self.reconnect_min
+        while not self.closing:
+            self.state = "connecting"
+            try:
+                await self.connect()
+                self.state = "authenticating"
+                await on_connect()
+                for event_name in self.subscribers:
+                    await self.send_subscription(event_name)
+                self.state = "ready"
+                self.connects += 1
+                delay = self.reconnect_min
+                logger.info("VTube Studio session ready")
+                if on_ready:
+                    await on_ready()
+                await self.reader
+            except Exception as e:
+                logger.warning(f"VTube Studio connection failed: {e!r}")
+            finally:
+                self.state = "disconnected"
+                if self.websocket:
+                    await self.websocket.close()
+
+            if self.closing:
+                return
+            # Jittered so a restarted VTube Studio is not hit in lockstep
+            await asyncio.sleep(delay * random.uniform(0.5, 1))
+            delay = min(delay * 2, self.reconnect_max)
+
+    async def read(self):
+        try:
+            async for frame in self.websocket:
+                try:
+                    response = json.loads(frame)
+                except ValueError:
+                    logger.warning(f"Malformed VTube Studio frame: {frame[:200]}")
+                    continue
+
+                future = self.pending.pop(response.get("requestID"), None)
+                if future:
+                    if not future.done():
+                        future.set_result(response)
+                    continue
+
+                message_type = response.get("messageType", "")
+                if message_type.endswith("Event"):
+                    self.events += 1
+                    self.dispatch(message_type, response.get("data", {}))
+                else:
+                    logger.debug(f"Unmatched VTube Studio response: {message_type}")
+        except websockets.exceptions.ConnectionClosed as e:
+            logger.info(f"VTube Studio connection closed: {e}")
+        finally:
+            # Nothing else will answer the requests still waiting
+            pending, self.pending = self.pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("VTube Studio disconnected"))
+
+    def dispatch(self, event_name, data):
+        for handler in self.subscribers.get(event_name, ()):
+            try:
+                result = handler(data)
+                if asyncio.iscoroutine(result):
+                    asyncio.create_task(result)
+            except Exception as e:
+                logger.error(f"VTube Studio {event_name} handler failed: {e}")
+
+    async def request(self, message_type, data=None, timeout=None):
+        if not self.connected:
+            raise ConnectionError("VTube Studio is not connected")
+
+        request_id = f"{self.prefix}-{next(self.counter)}"
+        payload = {
+            "apiName": "VTubeStudioPublicAPI",
+            "apiVersion": "1.0",
+            "requestID": request_id,
+            "messageType": message_type,
+        }
+        if data is not None:
+            payload["data"] = data
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.requests += 1
+        try:
+            await self.websocket.send(json.dumps(payload))
+            response = await asyncio.wait_for(future, timeout or self.timeout)
+        except websockets.exceptions.ConnectionClosed as e:
+            raise ConnectionError("VTube Studio disconnected") from e
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+            future.cancel()
+
+        if response.get("messageType") == "APIError":
+            error = response.get("data", {})
+            raise VTSError(message_type, error.get("errorID"), error.get("message"))
+        return response
+
+    async def subscribe(self, event_name, handler):
+        # Handlers receive the event's data and may be coroutines; the
+        # subscription is renewed on every reconnect
+        first = event_name not in self.subscribers
+        self.subscribers.setdefault(event_name, []).append(handler)
+        if first and self.ready:
+            await self.send_subscription(event_name)
+
+    async def send_subscription(self, event_name):
+        await self.request(
+            "EventSubscriptionRequest", {"eventName": event_name, "subscribe": True}
+        )
+
+    async def close(self):
+        self.closing = True
+        if self.websocket:
+            await self.websocket.close()
+        if self.supervisor:
+            self.supervisor.cancel()
+            await asyncio.gather(self.supervisor, return_exceptions=True)
+        if self.reader:
+            await asyncio.gather(self.reader, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "connects": self.connects,
+            "connected": self.connected,
+            "in_flight": len(self.pending),
+            "requests": self.requests,
+            "timeouts": self.timeouts,
+            "events": self.events,
+            "subscriptions": sorted(self.subscribers),
+        }
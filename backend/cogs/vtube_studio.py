@@ -1,29 +1,40 @@
 import asyncio
 import base64
-import json
+import functools
+import hashlib
 import os
-import random
-import websockets
+import uuid
 from twitchio.ext import commands
-from PIL import Image, ImageDraw, ImageFont
 from cogs.logging import logger
+from cogs.meme_renderer import MemeRenderer
+from cogs.meme_scheduler import ItemScheduler
+from cogs.vts_client import VTSClient, VTSError
 
 # Constants
 VTS_API_URL = os.getenv("VTS_API_URL")
 APP_NAME = os.getenv("VTS_APP_NAME")
 DEVELOPER = os.getenv("VTS_APP_DEVELOPER")
 PLUGIN_ICON_PATH = os.getenv("VTS_APP_ICON_PATH", None)
-IMAGE_WIDTH = 800
-IMAGE_HEIGHT = 600
-FONT_SIZE = 50
 FONT_PATH = os.path.expanduser(os.getenv("VTS_MEME_FONT"))
 VTS_ITEMS_PATH = os.path.expanduser(os.getenv("VTS_ITEMS_PATH"))
+VTS_TOKEN_PATH = os.path.expanduser(
+    os.getenv("VTS_TOKEN_PATH", "~/.local/state/beth-the-bot/vts_token")
+)
+# Long enough for the streamer to approve the plugin in VTube Studio
+AUTH_TOKEN_TIMEOUT = 120
 
 
 class VTubeStudioCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.websocket = None
+        self.vts = VTSClient(VTS_API_URL)
+        # Mirror of CurrentModelResponse, kept fresh by model events
+        self.model_info = None
+        self.renderer = MemeRenderer(FONT_PATH)
+        self.items = ItemScheduler(self.unload_items, VTS_ITEMS_PATH)
+        # Memes currently showing each expression, so overlapping memes only
+        # turn it off once the last of them expires
+        self.expression_users = {}
         self.expression_map = {
             "love": "1.exp3.json",
             "cry": "2.exp3.json",
@@ -35,23 +46,92 @@ class VTubeStudioCog(commands.Cog):
 
     @commands.Cog.event("event_ready")
     async def on_ready(self):
-        await self.connect_vts()
-
-    async def cog_unload(self):
-        if self.websocket:
-            await self.websocket.close()
+        # twitchio fires ready again on every Twitch reconnect, while the VTube
+        # Studio session is set up once and keeps itself alive
+        if self.vts.supervisor:
+            return
+        self.renderer.start()
+        self.items.start()
+        await self.vts.subscribe("ModelLoadedEvent", self.model_loaded)
+        await self.vts.subscribe("ModelMovedEvent", self.model_moved)
+        # The client reconnects and re-authenticates on its own from here on
+        self.vts.start(self.authenticate_session, self.refresh_model_info)
+
+    def cog_unload(self):
+        # twitchio calls this synchronously and drops whatever it returns
+        asyncio.create_task(self.close())
+
+    async def close(self):
+        await self.items.close()
+        await self.vts.close()
+        self.renderer.close()
+
+    async def authenticate_session(self):
+        # A saved token authenticates in one round trip without the approval
+        # popup; a new one is only requested if VTube Studio rejects it
+        auth_token = self.load_auth_token()
+        if auth_token and await self.authenticate(auth_token):
+            return
 
-    async def connect_vts(self):
-        self.websocket = await websockets.connect(VTS_API_URL)
         auth_token = await self.request_auth_token()
         if not auth_token:
-            logger.info("Could not obtain auth token. Exiting...")
-            return
+            raise ConnectionError("Could not obtain auth token")
+        if not await self.authenticate(auth_token):
+            raise ConnectionError("Authentication failed")
+        self.save_auth_token(auth_token)
+
+    async def refresh_model_info(self):
+        # Events may have been missed while disconnected, so this runs on
+        # every connect as well as whenever a model is (un)loaded
+        self.model_info = None
+        try:
+            self.model_info = await self.get_model_info()
+        except (VTSError, ConnectionError, asyncio.TimeoutError) as e:
+            logger.warning(f"Failed to refresh model info: {e!r}")
+
+    async def model_loaded(self, data):
+        await self.refresh_model_info()
+
+    def model_moved(self, data):
+        if self.model_info and data.get("modelID") == self.model_info["modelID"]:
+            self.model_info["modelPosition"] = data["modelPosition"]
+
+    def load_auth_token(self):
+        try:
+            with open(VTS_TOKEN_PATH, encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
 
-        authenticated = await self.authenticate(auth_token)
-        if not authenticated:
-            logger.info("Authentication failed. Exiting...")
+    def save_auth_token(self, auth_token):
+        try:
+            os.makedirs(os.path.dirname(VTS_TOKEN_PATH), exist_ok=True)
+            temp_path = f"{VTS_TOKEN_PATH}.tmp"
+            with open(
+                os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600),
+                "w",
+                encoding="utf-8",
+            ) as f:
+                f.write(auth_token)
+            os.replace(temp_path, VTS_TOKEN_PATH)
+        except OSError as e:
+            logger.warning(f"Failed to save VTube Studio auth token: {e}")
+
+    def write_file(self, path, data):
+        # Names are content hashes, so an existing file already holds the image
+        if os.path.exists(path):
             return
+        # Identical memes requested together write at the same time, so each
+        # write needs its own temp file
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
 
     def read_icon_base64(self, icon_path):
         if icon_path:
@@ -59,67 +139,33 @@ class VTubeStudioCog(commands.Cog):
                 return base64.b64encode(image_file.read()).decode("utf-8")
         return None
 
-    def generate_meme_image(self, top_text, bottom_text, output_path):
-        image = Image.new("RGBA", (IMAGE_WIDTH, IMAGE_HEIGHT), (255, 0, 0, 0))
-        draw = ImageDraw.Draw(image)
-        font = ImageFont.truetype(FONT_PATH, FONT_SIZE)
-        text_color = (255, 255, 255, 255)
-        border_color = (0, 0, 0, 255)
-
-        # Calculate text size and position for top text
-        top_text_bbox = draw.textbbox((0, 0), top_text, font=font, stroke_width=2)
-        top_text_width = top_text_bbox[2] - top_text_bbox[0]
-        top_text_position = ((IMAGE_WIDTH - top_text_width) / 2, 10)
-        draw.text(
-            (top_text_position),
-            top_text,
-            font=font,
-            fill=text_color,
-            stroke_width=2,
-            stroke_fill=border_color,
-        )
-
-        # Calculate text size and position for bottom text
-        bottom_text_bbox = draw.textbbox((0, 0), bottom_text, font=font, stroke_width=2)
-        bottom_text_width = bottom_text_bbox[2] - bottom_text_bbox[0]
-        bottom_text_height = bottom_text_bbox[3] - bottom_text_bbox[1]
-        bottom_text_position = (
-            (IMAGE_WIDTH - bottom_text_width) / 2,
-            IMAGE_HEIGHT - bottom_text_height - 10,
-        )
-        draw.text(
-            (bottom_text_position),
-            bottom_text,
-            font=font,
-            fill=text_color,
-            stroke_width=2,
-            stroke_fill=border_color,
-        )
-
-        image.save(output_path, "PNG")
+    async def generate_meme_image(self, top_text, bottom_text):
+        # Identical memes share one file, and distinct ones can never collide.
+        # The caller owns a hold on the returned path until it hands it to
+        # the item scheduler or releases it.
+        png = await self.renderer.render_async(top_text, bottom_text)
+        image_name = f"meme_image_{hashlib.sha1(png).hexdigest()[:16]}.png"
+        output_path = os.path.join(VTS_ITEMS_PATH, image_name)
+        self.items.hold(output_path)
+        try:
+            await asyncio.to_thread(self.write_file, output_path, png)
+        except BaseException:
+            self.items.release(output_path)
+            raise
         logger.debug(f"Meme image generated and saved as '{output_path}'")
-
-    async def query(self, payload):
-        await self.websocket.send(json.dumps(payload))
-        response = await self.websocket.recv()
-        response_data = json.loads(response)
-        return response_data
+        return image_name, output_path
 
     async def request_auth_token(self):
         plugin_icon_base64 = self.read_icon_base64(PLUGIN_ICON_PATH)
-        request_auth_payload = {
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": "auth_request",
-            "messageType": "AuthenticationTokenRequest",
-            "data": {
+        response_data = await self.vts.request(
+            "AuthenticationTokenRequest",
+            {
                 "pluginName": APP_NAME,
                 "pluginDeveloper": DEVELOPER,
                 "pluginIcon": plugin_icon_base64,
             },
-        }
-
-        response_data = await self.query(request_auth_payload)
+            timeout=AUTH_TOKEN_TIMEOUT,
+        )
         logger.debug(f"Auth token response: {response_data}")
 
         if (
@@ -134,19 +180,14 @@ class VTubeStudioCog(commands.Cog):
             return None
 
     async def authenticate(self, auth_token):
-        authenticate_payload = {
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": "auth_request",
-            "messageType": "AuthenticationRequest",
-            "data": {
+        response_data = await self.vts.request(
+            "AuthenticationRequest",
+            {
                 "pluginName": APP_NAME,
                 "pluginDeveloper": DEVELOPER,
                 "authenticationToken": auth_token,
             },
-        }
-
-        response_data = await self.query(authenticate_payload)
+        )
         logger.debug(f"Auth response: {response_data}")
 
         if (
@@ -161,14 +202,7 @@ class VTubeStudioCog(commands.Cog):
                 return False
 
     async def get_model_info(self):
-        model_info_payload = {
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": "model_info_request",
-            "messageType": "CurrentModelRequest",
-        }
-
-        response_data = await self.query(model_info_payload)
+        response_data = await self.vts.request("CurrentModelRequest")
         logger.debug(f"Model info response: {response_data}")
 
         if (
@@ -186,12 +220,9 @@ class VTubeStudioCog(commands.Cog):
         self, image_name, model_id, model_x, model_y, model_size
     ):
         size = abs(model_size)
-        load_item_payload = {
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": "load_item_request",
-            "messageType": "ItemLoadRequest",
-            "data": {
+        response_data = await self.vts.request(
+            "ItemLoadRequest",
+            {
                 "fileName": image_name,
                 "positionX": model_x,
                 "positionY": model_y,
@@ -200,9 +231,7 @@ class VTubeStudioCog(commands.Cog):
                 "opacity": 1.0,
                 "isPinned": False,
             },
-        }
-
-        response_data = await self.query(load_item_payload)
+        )
         logger.debug(f"Load item response: {response_data}")
 
         if (
@@ -220,12 +249,9 @@ class VTubeStudioCog(commands.Cog):
     async def pin_item_to_model(
         self, item_instance_id, model_id, model_size, art_mesh_id=""
     ):
-        pin_item_payload = {
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": "pin_item_request",
-            "messageType": "ItemPinRequest",
-            "data": {
+        response_data = await self.vts.request(
+            "ItemPinRequest",
+            {
                 "pin": True,
                 "itemInstanceID": item_instance_id,
                 "angleRelativeTo": "RelativeToModel",
@@ -244,9 +270,7 @@ class VTubeStudioCog(commands.Cog):
                     "vertexWeight3": 0.29864418506622314,
                 },
             },
-        }
-
-        response_data = await self.query(pin_item_payload)
+        )
         logger.debug(f"Pin Item response: {response_data}")
 
         if (
@@ -260,42 +284,32 @@ class VTubeStudioCog(commands.Cog):
         else:
             logger.info("Failed to pin item")
 
-    async def unload_item(self, item_instance_id):
-        unload_item_payload = {
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": "unload_item_request",
-            "messageType": "ItemUnloadRequest",
-            "data": {"instanceIDs": [item_instance_id]},
-        }
-
-        response_data = await self.query(unload_item_payload)
-        logger.debug(f"Unload item response: {response_data}")
+    async def unload_items(self, item_instance_ids):
+        response_data = await self.vts.request(
+            "ItemUnloadRequest", {"instanceIDs": item_instance_ids}
+        )
+        logger.debug(f"Unload items response: {response_data}")
 
         if (
             response_data.get("data")
             and response_data["messageType"] == "ItemUnloadResponse"
         ):
-            if len(response_data["data"]["unloadedItems"]):
-                logger.debug("Item unloaded successfully")
-            else:
-                logger.info("Failed to unload item")
+            unloaded = len(response_data["data"]["unloadedItems"])
+            if unloaded < len(item_instance_ids):
+                logger.info(f"Unloaded {unloaded} of {len(item_instance_ids)} items")
+            return unloaded
         else:
-            logger.info("Failed to unload item")
+            logger.info("Failed to unload items")
+            return 0
 
     async def toggle_expression(self, expression_file, expression_state):
-        trigger_expression_payload = {
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": "trigger_expression_request",
-            "messageType": "ExpressionActivationRequest",
-            "data": {
+        response_data = await self.vts.request(
+            "ExpressionActivationRequest",
+            {
                 "expressionFile": expression_file,
                 "active": expression_state,
             },
-        }
-
-        response_data = await self.query(trigger_expression_payload)
+        )
         logger.debug(f"Trigger expression response: {response_data}")
 
         if response_data.get("messageType") == "ExpressionActivationResponse":
@@ -303,11 +317,39 @@ class VTubeStudioCog(commands.Cog):
         else:
             logger.info(f"Failed to trigger expression {expression_file}")
 
+    async def use_expression(self, expression_file):
+        count = self.expression_users.get(expression_file, 0)
+        self.expression_users[expression_file] = count + 1
+        if not count:
+            await self.toggle_expression(expression_file, True)
+
+    async def release_expression(self, expression_file):
+        count = self.expression_users.get(expression_file, 0) - 1
+        if count > 0:
+            self.expression_users[expression_file] = count
+            return
+        self.expression_users.pop(expression_file, None)
+        await self.toggle_expression(expression_file, False)
+
     def convert_modelsize_to_itemsize(self, model_size):
         return (model_size + 100) / 200
 
     @commands.command(name="meme")
     async def meme_command(self, ctx, *, text: str):
+        if not self.vts.ready:
+            await ctx.send("VTube Studio is not connected.")
+            return
+
+        try:
+            await self.show_meme(ctx, text)
+        except (VTSError, ConnectionError, asyncio.TimeoutError) as e:
+            logger.error(f"Meme failed: {e!r}")
+            await ctx.send("VTube Studio is not responding.")
+        except OSError as e:
+            logger.error(f"Meme image could not be written: {e}")
+            await ctx.send("Could not save the meme image.")
+
+    async def show_meme(self, ctx, text):
         parts = text.split("|")
         top_text = parts[0].strip()
         bottom_text = parts[1].strip() if len(parts) > 1 else ""
@@ -323,20 +365,54 @@ class VTubeStudioCog(commands.Cog):
             )
             return
 
-        model_info = await self.get_model_info()
+        if not self.model_info:
+            # Only when the mirror is cold, e.g. VTube Studio has no model
+            await self.refresh_model_info()
+        model_info = self.model_info
         if not model_info:
             await ctx.send("Could not obtain model info.")
             return
 
+        image_name, image_path = await self.generate_meme_image(top_text, bottom_text)
+
+        # The expression does not depend on the item, so it is requested
+        # alongside the load instead of after the pin
+        expression_file = self.expression_map[expression] if expression else None
+        try:
+            placing = self.place_item(image_name, model_info)
+            if expression_file:
+                item_instance_id, _ = await asyncio.gather(
+                    placing, self.use_expression(expression_file)
+                )
+            else:
+                item_instance_id = await placing
+        except BaseException:
+            await self.abandon_meme(image_path, expression_file)
+            raise
+
+        if not item_instance_id:
+            await self.abandon_meme(image_path, expression_file)
+            await ctx.send("Could not add item to scene.")
+            return
+
+        # The scheduler unloads the item, deletes its image once unused and
+        # turns the expression back off, so the command returns right away
+        on_expire = None
+        if expression_file:
+            on_expire = functools.partial(self.release_expression, expression_file)
+        self.items.add(item_instance_id, image_path, on_expire)
+
+    async def abandon_meme(self, image_path, expression_file):
+        self.items.release(image_path)
+        if expression_file:
+            await self.release_expression(expression_file)
+
+    async def place_item(self, image_name, model_info):
         model_id = model_info["modelID"]
         model_size = model_info["modelPosition"]["size"]
         model_x = model_info["modelPosition"]["positionX"]
         model_y = model_info["modelPosition"]["positionY"]
 
-        image_name = f"meme_image_{random.randint(1000, 9999)}.png"
-        image_path = os.path.join(VTS_ITEMS_PATH, image_name)
-        self.generate_meme_image(top_text, bottom_text, image_path)
-
         item_instance_id = await self.add_item_to_scene(
             image_name,
             model_id,
@@ -344,22 +420,9 @@ class VTubeStudioCog(commands.Cog):
             model_y,
             self.convert_modelsize_to_itemsize(model_size),
         )
-        if not item_instance_id:
-            await ctx.send("Could not add item to scene.")
-            return
-
-        await self.pin_item_to_model(item_instance_id, model_id, model_size)
-
-        if expression:
-            expression_file = self.expression_map[expression]
-            await self.toggle_expression(expression_file, True)
-
-        await asyncio.sleep(10)
-
-        await self.unload_item(item_instance_id)
-
-        if expression:
-            await self.toggle_expression(expression_file, False)
+        if item_instance_id:
+            await self.pin_item_to_model(item_instance_id, model_id, model_size)
+        return item_instance_id
 
 
 def prepare(bot):
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import io from 'socket.io-client';
 import './TTSAvatar.css';
@@ -9,8 +9,9 @@ const socket = io('http://localhost:5001');
 const TTSAvatar = () => {
     const [avatar, setAvatar] = useState('');
     const [message, setMessage] = useState('');
-    const [messageAmplitudes, setMessageAmplitudes] = useState([])
     const [guest, setGuest] = useState('');
+    const envelope = useRef({ levels: [], rate: 30, start: null });
+    const animationFrame = useRef(null);
 
     useEffect(() => {
         // Fetch a random avatar from the avatars directory
@@ -41,13 +42,30 @@ const TTSAvatar = () => {
 
         socket.on('message_update', (data) => {
             setMessage(data.message);
-            setMessageAmplitudes(data.amplitudes || [])
+            if (data.message) {
+                startBounce(decodeEnvelope(data.envelope), data.frame_rate || 30);
+            } else {
+                stopBounce();
+            }
+        });
+
+        socket.on('message_envelope', (data) => {
+            envelope.current.levels.push(...decodeEnvelope(data.envelope));
+        });
+
+        socket.on('playback_started', (data) => {
+            // The first sample is heard once the output latency has elapsed
+            envelope.current.start = performance.now() + (data.latency || 0) * 1000;
+        });
+
+        socket.on('playback_finished', () => {
+            stopBounce();
         });
 
         socket.on('guest_clear', () => {
             setGuest('');
             setMessage('');
-            setMessageAmplitudes([]);
+            stopBounce();
             setAvatar('');
         })
 
@@ -55,49 +73,54 @@ const TTSAvatar = () => {
             // Clean up WebSocket listeners on component unmount
             socket.off('guest_update');
             socket.off('message_update');
+            socket.off('message_envelope');
+            socket.off('playback_started');
+            socket.off('playback_finished');
             socket.off('guest_clear');
         };
     }, [guest]);
 
     useEffect(() => {
-        if (messageAmplitudes && messageAmplitudes.length > 0) {
-            generateKeyframes(messageAmplitudes);
-        } else {
-            const avatar_element = document.querySelector('.avatar-image');
-            if (avatar_element) {
-                avatar_element.style.animation = '';
-            }
-        }
-    }, [messageAmplitudes])
-
-    const generateKeyframes = (amplitudes) => {
-        const sample_rate = 22050;
-        const duration = amplitudes.length / sample_rate;
-        console.log(amplitudes.length)
-        const sample_factor = Math.floor(amplitudes.length / 200);
-        const sampled_amplitudes = amplitudes.filter((_, index) => index % sample_factor === 0);
-
-        const keyframes = sampled_amplitudes.map((amp, index) => {
-            const percentage = Math.ceil((index / sampled_amplitudes.length) * 100);
-            const translateY = amp * 48;
-            return `${percentage}% { transform: translateY(-${translateY}px); }`;
-        }).join('\n');
-        const stylesheet = document.styleSheets[0];
-        const animation_name = 'avatarBounceAnimation';
-        const keyframesRule = `@keyframes ${animation_name} { ${keyframes} }`;
-
-        for (let i = stylesheet.cssRules.length - 1; i >= 0; i--) {
-            if (stylesheet.cssRules[i].name === animation_name) {
-                stylesheet.deleteRule(i);
-            }
-        }
+        return () => cancelAnimationFrame(animationFrame.current);
+    }, []);
+
+    const decodeEnvelope = (data) => {
+        // The envelope is one quantized byte per frame, sent either as a binary
+        // attachment or as a plain list of ints
+        return data ? Array.from(new Uint8Array(data), (level) => level / 255) : [];
+    };
 
-        stylesheet.insertRule(keyframesRule, stylesheet.cssRules.length)
+    const startBounce = (levels, rate) => {
+        envelope.current = {
+            levels: levels,
+            rate: rate,
+            start: null,
+        };
+        cancelAnimationFrame(animationFrame.current);
+        animationFrame.current = requestAnimationFrame(bounce);
+    };
 
+    const stopBounce = () => {
+        cancelAnimationFrame(animationFrame.current);
+        envelope.current = { levels: [], rate: 30, start: null };
         const avatar_element = document.querySelector('.avatar-image');
-        if (avatar_element)
-            avatar_element.style.animation = `${animation_name} ${duration}s linear`
-    }
+        if (avatar_element) {
+            avatar_element.style.transform = '';
+        }
+    };
+
+    const bounce = () => {
+        // Envelope frames arrive chunk by chunk while the audio is playing, so
+        // the position is driven by elapsed time rather than a precomputed animation
+        const { levels, rate, start } = envelope.current;
+        const avatar_element = document.querySelector('.avatar-image');
+        if (avatar_element && start !== null) {
+            const index = Math.floor(((performance.now() - start) / 1000) * rate);
+            const amp = index >= 0 && index < levels.length ? levels[index] : 0;
+            avatar_element.style.transform = `translateY(-${amp * 48}px)`;
+        }
+        animationFrame.current = requestAnimationFrame(bounce);
+    };
 
     const handlePickGuest = async () => {
         try {
@@ -0,0 +1,80 @@
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../backend"))
+from cogs.guest_registry import GuestRegistry
+
+ENTRANTS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+
+class Chatter:
+    def __init__(self, name):
+        self.name = name
+
+
+# The list-of-tuples guest list TTSGuestCog used before GuestRegistry
+class GuestList:
+    def __init__(self):
+        self.guest_list = []
+
+    def join(self, chatter, timestamp):
+        if chatter.name in [guest[0].name for guest in self.guest_list]:
+            self.guest_list = [
+                (guest[0], timestamp) if guest[0].name == chatter.name else guest
+                for guest in self.guest_list
+            ]
+            return
+        self.guest_list.append((chatter, timestamp))
+
+    def pick(self):
+        picked = random.choice(self.guest_list)
+        self.guest_list = [
+            guest for guest in self.guest_list if guest[0].name != picked[0].name
+        ]
+        return picked
+
+
+class Registry:
+    def __init__(self, half_life=0):
+        self.registry = GuestRegistry(half_life)
+
+    def join(self, chatter, timestamp):
+        self.registry.add(chatter, timestamp)
+
+    def pick(self):
+        return self.registry.pick()
+
+
+def bench(name, guests, chatters):
+    now = datetime.datetime.utcnow()
+    start = time.perf_counter()
+    for chatter in chatters:
+        guests.join(chatter, now)
+    joined = time.perf_counter()
+
+    # A raid: everyone spams !guest a second time
+    for chatter in chatters:
+        guests.join(chatter, now)
+    refreshed = time.perf_counter()
+
+    for _ in range(len(chatters) // 10):
+        guests.pick()
+    picked = time.perf_counter()
+
+    print(
+        f"{name:<24} join {joined - start:8.4f}s  "
+        f"refresh {refreshed - joined:8.4f}s  "
+        f"pick 10% {picked - refreshed:8.4f}s  "
+        f"total {picked - start:8.4f}s"
+    )
+
+
+if __name__ == "__main__":
+    chatters = [Chatter(f"viewer{i}") for i in range(ENTRANTS)]
+    print(f"{ENTRANTS} entrants")
+    bench("GuestRegistry", Registry(), chatters)
+    bench("GuestRegistry weighted", Registry(half_life=60), chatters)
+    bench("list of tuples", GuestList(), chatters)
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../backend"))
+from cogs.meme_renderer import MEME_RENDER_WORKERS, MemeRenderer, render_meme
+
+FONT_PATH = os.path.expanduser(
+    sys.argv[1] if len(sys.argv) > 1 else os.getenv("VTS_MEME_FONT", "")
+)
+MEMES = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+WORKERS = int(sys.argv[3]) if len(sys.argv) > 3 else MEME_RENDER_WORKERS
+
+
+def texts(run):
+    # Unique per run so the render cache never helps
+    return [(f"{run} top text {i}", f"bottom text number {i}") for i in range(MEMES)]
+
+
+# Measures the longest gap between event loop ticks, i.e. how long chat
+# handling would have been stalled
+async def watch_loop(stalls, interval=0.001):
+    last = time.perf_counter()
+    while True:
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        stalls.append(now - last - interval)
+        last = now
+
+
+async def run(name, render):
+    stalls = []
+    watcher = asyncio.create_task(watch_loop(stalls))
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    await render()
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+    print(
+        f"{name:>22}: {MEMES / elapsed:7.1f} memes/s, "
+        f"longest event loop stall {max(stalls) * 1000:6.1f}ms"
+    )
+
+
+async def main():
+    if not FONT_PATH:
+        print("usage: bench_meme_renderer.py FONT_PATH [MEMES] [WORKERS]")
+        return
+
+    async def inline():
+        # As !meme rendered before: Pillow straight on the event loop
+        for top_text, bottom_text in texts("inline"):
+            render_meme(FONT_PATH, top_text, bottom_text, compression=6)
+            await asyncio.sleep(0)
+
+    async def inline_fast():
+        for top_text, bottom_text in texts("inline-fast"):
+            render_meme(FONT_PATH, top_text, bottom_text)
+            await asyncio.sleep(0)
+
+    renderer = MemeRenderer(FONT_PATH, entries=0, workers=WORKERS)
+    renderer.start()
+    # Let the workers spawn and load the font before timing
+    await asyncio.gather(renderer.render_async("warm", "up"))
+
+    async def pooled():
+        await asyncio.gather(
+            *(renderer.render_async(*pair) for pair in texts("pooled"))
+        )
+
+    await run("inline, old settings", inline)
+    await run("inline, fast settings", inline_fast)
+    await run(f"pool of {WORKERS}", pooled)
+    renderer.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
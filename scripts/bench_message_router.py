@@ -0,0 +1,142 @@
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../backend"))
+from cogs.message_router import MessageRouter
+
+MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+RATE = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+CHATTERS = 5000
+GUEST = "chatter42"
+
+
+class Chatter:
+    def __init__(self, name):
+        self.name = name
+
+
+class Message:
+    def __init__(self, author, content):
+        self.author = author
+        self.content = content
+        self.echo = False
+
+
+class Counters:
+    def __init__(self):
+        self.logged = 0
+        self.guest = 0
+        self.commands = 0
+
+    def log_message(self, message):
+        self.logged += 1
+
+    async def guest_message(self, message):
+        self.guest += 1
+
+    def command(self, message):
+        self.commands += 1
+
+
+def synthetic_messages(count):
+    chatters = [Chatter(f"chatter{i}") for i in range(CHATTERS)]
+    words = ["hello", "lol", "pog", "nice", "what", "!meme top | bottom", "!guest"]
+    return [
+        Message(random.choice(chatters), " ".join(random.choices(words, k=4)))
+        for _ in range(count)
+    ]
+
+
+# Every listener receives every message and filters it itself, as the cogs'
+# event_message handlers did before the router
+async def broadcast(messages, counters):
+    async def logger_cog(message):
+        if not message.echo:
+            counters.log_message(message)
+
+    async def tts_guest_cog(message):
+        if message.echo:
+            return
+        if message.author.name == GUEST:
+            await counters.guest_message(message)
+
+    async def bot(message):
+        if message.echo:
+            return
+        if message.content.startswith("!"):
+            counters.command(message)
+
+    listeners = [logger_cog, tts_guest_cog, bot]
+    for message in messages:
+        for listener in listeners:
+            asyncio.create_task(listener(message))
+    await asyncio.sleep(0)
+
+
+async def routed(messages, counters):
+    router = MessageRouter()
+    router.subscribe(counters.log_message)
+    router.subscribe(counters.guest_message, author=GUEST)
+    router.subscribe(counters.command, prefix="!")
+    for message in messages:
+        router.dispatch(message)
+    await asyncio.sleep(0)
+    return router
+
+
+async def paced(messages, rate):
+    # Feeds messages at a fixed rate and records how long each dispatch took
+    counters = Counters()
+    router = MessageRouter()
+    router.subscribe(counters.log_message)
+    router.subscribe(counters.guest_message, author=GUEST)
+    router.subscribe(counters.command, prefix="!")
+
+    latencies = []
+    interval = 1 / rate
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        began = time.perf_counter()
+        router.dispatch(message)
+        latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return (
+        len(messages) / elapsed,
+        latencies[len(latencies) // 2],
+        latencies[int(len(latencies) * 0.99)],
+    )
+
+
+async def main():
+    random.seed(0)
+    messages = synthetic_messages(MESSAGES)
+
+    for name, run in (("broadcast", broadcast), ("router", routed)):
+        counters = Counters()
+        start = time.perf_counter()
+        await run(messages, counters)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:>9}: {MESSAGES / elapsed:10.0f} messages/s "
+            f"(logged {counters.logged}, guest {counters.guest}, "
+            f"commands {counters.commands})"
+        )
+
+    count = min(MESSAGES, RATE * 5)
+    throughput, median, p99 = await paced(messages[:count], RATE)
+    print(
+        f"paced at {RATE}/s: {throughput:.0f} messages/s, dispatch median "
+        f"{median * 1e6:.1f}us, p99 {p99 * 1e6:.1f}us"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+import asyncio
+import collections
+import datetime
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../backend"))
+from cogs.chat_archive import CHAT_ARCHIVE_DIR, ChatArchive
+from cogs.guest_registry import SimpleChatter
+from cogs.message_router import MessageRouter
+from cogs.tts_queue import MessageQueue, QueuedMessage
+from cogs.tts_text import TextNormalizer
+
+# Replays archived chat through the bot's message routing and TTS text path.
+# SPEED scales the original timing; 0 replays as fast as possible.
+SPEED = float(sys.argv[1]) if len(sys.argv) > 1 else 0
+GUEST = sys.argv[2].lower() if len(sys.argv) > 2 else None
+
+
+class Channel:
+    def __init__(self, name):
+        self.name = name
+
+
+class Message:
+    def __init__(self, record):
+        timestamp, channel, author, content = record
+        self.timestamp = datetime.datetime.fromtimestamp(
+            timestamp, datetime.timezone.utc
+        ).replace(tzinfo=None)
+        self.channel = Channel(channel)
+        self.author = SimpleChatter(author)
+        self.content = content
+        self.tags = {}
+        self.echo = False
+
+
+async def main():
+    # Read-only, so replaying never touches the indexes of a running bot
+    archive = ChatArchive(CHAT_ARCHIVE_DIR, read_only=True)
+    records = list(archive.replay())
+    if not records:
+        print(f"No archived chat in {CHAT_ARCHIVE_DIR}")
+        return
+
+    guest = (
+        GUEST
+        or collections.Counter(record[2] for record in records).most_common(1)[0][0]
+    )
+    normalizer = TextNormalizer()
+    # Timestamps are from the past, so age-based expiry is disabled
+    message_queue = MessageQueue(max_age=0)
+    counts = collections.Counter()
+
+    def count_message(message):
+        counts["messages"] += 1
+
+    def guest_message(message):
+        text = normalizer.normalize(message.content)
+        if text and message_queue.append(
+            QueuedMessage(message.author, text, message.timestamp)
+        ):
+            counts["queued"] += 1
+        # Playback is not simulated, so drain as messages arrive
+        message_queue.popleft()
+
+    router = MessageRouter()
+    router.subscribe(count_message)
+    router.subscribe(guest_message, author=guest)
+
+    first = records[0][0]
+    start = time.perf_counter()
+    latencies = []
+    for record in records:
+        if SPEED:
+            delay = (record[0] - first) / SPEED - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        began = time.perf_counter()
+        router.dispatch(Message(record))
+        latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(
+        f"Replayed {len(records)} messages in {elapsed:.2f}s "
+        f"({len(records) / elapsed:.0f} messages/s), guest {guest} "
+        f"queued {counts['queued']}"
+    )
+    print(
+        f"dispatch median {latencies[len(latencies) // 2] * 1e6:.1f}us, "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.1f}us"
+    )
+    print(f"normalizer: {normalizer.stats()}")
+    archive.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())